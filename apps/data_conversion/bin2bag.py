@@ -8,14 +8,15 @@ import numpy as np
 import pykitti
 import rosbag
 import rospy
-import sensor_msgs.point_cloud2 as pcl2
 import tf
 from geometry_msgs.msg import Transform, TransformStamped
-from sensor_msgs.msg import PointField
+from sensor_msgs.msg import PointCloud2, PointField
 from std_msgs.msg import Header
 from tf2_msgs.msg import TFMessage
 from tqdm import tqdm
 
+from puma.utils import array_to_pointcloud2, xyzi_to_structured
+
 
 def write_gt_pose_to_bag(bag, gt_pose, timestamp):
     tf_msg = TFMessage()
@@ -49,14 +50,20 @@ def write_scan_to_bag(bag, scan, timestamp):
     header.frame_id = "velodyne"
     header.stamp = rospy.Time.from_sec(timestamp)
 
-    # fill pcl msg
-    fields = [
-        PointField("x", 0, PointField.FLOAT32, 1),
-        PointField("y", 4, PointField.FLOAT32, 1),
-        PointField("z", 8, PointField.FLOAT32, 1),
-        PointField("intensity", 12, PointField.FLOAT32, 1),
-    ]
-    pcl_msg = pcl2.create_cloud(header, fields, scan)
+    # fill pcl msg, the scan buffer is copied as it is
+    points = xyzi_to_structured(scan)
+    fields, point_step, data = array_to_pointcloud2(points)
+    pcl_msg = PointCloud2(
+        header=header,
+        height=1,
+        width=len(points),
+        fields=[PointField(*field) for field in fields],
+        is_bigendian=False,
+        point_step=point_step,
+        row_step=point_step * len(points),
+        data=data,
+        is_dense=False,
+    )
 
     bag.write("/velodyne_points", pcl_msg, t=pcl_msg.header.stamp)
 
@@ -4,34 +4,16 @@ import glob
 import os
 
 import click
-import numpy as np
 import open3d as o3d
 import pykitti
-from tqdm import tqdm
 
+from puma.datasets import load_velo_scan, vel2ply
+from puma.utils import convert_files
 
-def load_velo_scan(file):
-    """Load and parse a velodyne binary file."""
-    scan = np.fromfile(file, dtype=np.float32)
-    return scan.reshape((-1, 4))
 
-
-def yield_velo_scans(velo_files):
-    """Generator to parse velodyne binary files into arrays."""
-    for file in velo_files:
-        yield load_velo_scan(file)
-
-
-def vel2ply(points, use_intensity=False):
-    pcd = o3d.geometry.PointCloud()
-    points_xyz = points[:, :3]
-    points_i = points[:, -1].reshape(-1, 1)
-    pcd.points = o3d.utility.Vector3dVector(points_xyz)
-    if use_intensity:
-        pcd.colors = o3d.utility.Vector3dVector(
-            np.full_like(points_xyz, points_i)
-        )
-    return pcd
+def bin2ply(velo_file, use_intensity, ply_file):
+    pcd = vel2ply(load_velo_scan(velo_file), use_intensity)
+    o3d.io.write_point_cloud(ply_file, pcd)
 
 
 @click.command()
@@ -65,7 +47,14 @@ def vel2ply(points, use_intensity=False):
     default=False,
     help="Encode the intensity value in the color channel",
 )
-def main(dataset, out_dir, sequence, use_intensity):
+@click.option(
+    "--n_workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of conversion processes, one per CPU by default",
+)
+def main(dataset, out_dir, sequence, use_intensity, n_workers):
     """Utility script to convert from the binary form found in the KITTI
     odometry dataset to .ply files. The intensity value for each measurement is
     encoded in the color channel of the output PointCloud.
@@ -76,6 +65,9 @@ def main(dataset, out_dir, sequence, use_intensity):
 
     If no sequence is specified then it blindly reads all the *.bin file in the
     specified dataset directory
+
+    The scans already converted are skipped, so an interrupted conversion can
+    be resumed by running the same command again.
     """
     print(
         "Converting .bin scans into .ply fromat from:{orig} to:{dest}".format(
@@ -90,21 +82,18 @@ def main(dataset, out_dir, sequence, use_intensity):
         os.makedirs(base_path, exist_ok=True)
         data = pykitti.odometry(dataset, sequence)
         velo_files = data.velo_files
-        scans = data.velo
     else:
         # Read all the *.bin scans from the dataset folder
         base_path = os.path.join(out_dir, "")
         os.makedirs(base_path, exist_ok=True)
         velo_files = sorted(glob.glob(os.path.join(dataset, "*.bin")))
-        scans = yield_velo_scans(velo_files)
 
-    for points, scan_name in tqdm(
-        zip(scans, velo_files), total=len(velo_files)
-    ):
-        pcd = vel2ply(points, use_intensity)
+    jobs = []
+    for scan_name in velo_files:
         stem = os.path.splitext(scan_name.split("/")[-1])[0]
         filename = base_path + stem + ".ply"
-        o3d.io.write_point_cloud(filename, pcd)
+        jobs.append(((scan_name, use_intensity), filename))
+    convert_files(bin2ply, jobs, len(jobs), n_workers)
 
 
 if __name__ == "__main__":
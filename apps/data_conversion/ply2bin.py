@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 import glob
 import os
-import struct
 
 import click
 import numpy as np
 import open3d as o3d
-from tqdm import tqdm
+
+from puma.utils import convert_files
 
 
 def save_bin_file(file, points):
-    with open(file, "wb") as bin_file:
-        for point in points.tolist():
-            bin_file.write(struct.pack("f" * len(point), *point))
+    points.astype(np.float32).tofile(file)
+
+
+def ply2bin(scan_name, out_file):
+    scan = o3d.io.read_point_cloud(scan_name)
+    points = np.asarray(scan.points)
+    intensity = np.ones(points.shape[0]) / 2.0
+    # convert from (size,) to (size,1)
+    intensity = intensity.reshape(-1, 1)
+    xyzi_points = np.hstack((points, intensity))
+    save_bin_file(out_file, xyzi_points)
 
 
 def get_bin_filaname(dataset_out, scan_name):
@@ -38,21 +46,26 @@ def get_bin_filaname(dataset_out, scan_name):
 @click.option(
     "--sequence", "-s", type=str, default="00", help="Sequence number"
 )
-def main(dataset, out_dir, sequence):
+@click.option(
+    "--n_workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of conversion processes, one per CPU by default",
+)
+def main(dataset, out_dir, sequence, n_workers):
     dataset_in = os.path.join(dataset, "sequences", sequence, "velodyne", "")
     dataset_out = os.path.join(out_dir, "sequences", sequence, "velodyne", "")
     print("Converting ply files from " + dataset_in)
 
+    os.makedirs(dataset_out, exist_ok=True)
+
     scan_names = sorted(glob.glob(dataset_in + "*.ply"))
-    for scan_name in tqdm(scan_names):
-        scan = o3d.io.read_point_cloud(scan_name)
-        points = np.asarray(scan.points)
-        intensity = np.ones(points.shape[0]) / 2.0
-        # convert from (size,) to (size,1)
-        intensity = intensity.reshape(-1, 1)
-        xyzi_points = np.hstack((points, intensity))
-        out_file = get_bin_filaname(dataset_out, scan_name)
-        save_bin_file(out_file, xyzi_points)
+    jobs = [
+        ((scan_name,), get_bin_filaname(dataset_out, scan_name))
+        for scan_name in scan_names
+    ]
+    convert_files(ply2bin, jobs, len(jobs), n_workers)
 
 
 if __name__ == "__main__":
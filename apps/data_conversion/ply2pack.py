@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import glob
+import os
+
+import click
+import open3d as o3d
+from tqdm import tqdm
+
+from puma.datasets import write_packed_sequence
+
+
+@click.command()
+@click.option(
+    "--dataset",
+    "-d",
+    type=click.Path(exists=True),
+    default=os.environ["HOME"] + "/data/kitti-odometry/ply/",
+    help="Location of the KITTI-like dataset",
+)
+@click.option(
+    "--sequence", "-s", type=str, default="00", help="Sequence number"
+)
+def main(dataset, sequence):
+    """Pack all the .ply scans of a sequence into one contiguous float32 file
+    plus an offset index, stored next to the original scans:
+
+    \b
+    sequences/00
+    ├── velodyne
+    │   ├── 000000.ply
+    │   └── ...
+    └── velodyne_packed
+        ├── index.npz
+        └── scans.f32
+
+    All the pipelines pick the packed sequence automatically if it exists.
+    Only the raw points are packed, the scans are still preprocessed by each
+    pipeline according to its own config.
+    """
+    sequence_dir = os.path.join(dataset, "sequences", sequence)
+    scan_names = sorted(
+        glob.glob(os.path.join(sequence_dir, "velodyne", "*.ply"))
+    )
+    out_dir = os.path.join(sequence_dir, "velodyne_packed")
+    print("Packing {} scans into {}".format(len(scan_names), out_dir))
+
+    clouds = (
+        o3d.io.read_point_cloud(scan_name) for scan_name in tqdm(scan_names)
+    )
+    write_packed_sequence(out_dir, clouds)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,37 +7,33 @@ import click
 import numpy as np
 import open3d as o3d
 import rosbag
-import sensor_msgs.point_cloud2 as pc2
-from tqdm import tqdm
 
+from puma.utils import convert_files, read_points_array
 
-def convert_bag_to_ply(bag, topic, out_dir):
+
+def msg2ply(msg, filename):
     field_names = ["x", "y", "z", "intensity"]
     max_intensity = 1000  # HACK: expose parameter
-    bag_msgs = bag.read_messages(topics=[topic])
-    msg_count = bag.get_message_count(topic)
+    points = read_points_array(msg, field_names, skip_nans=True)
 
-    for idx, (_, msg, _) in tqdm(enumerate(bag_msgs), total=msg_count):
-        points_xyz = []
-        points_i = []
-        points = pc2.read_points_list(
-            cloud=msg, field_names=field_names, skip_nans=True
-        )
+    points_xyz = points[:, :3]
+    points_i = np.repeat(points[:, 3:], 3, axis=1)
+    points_i = (points_i / max_intensity).clip(0.0, 1.0)
 
-        for point_xyzi in points:
-            x, y, z, i = point_xyzi
-            points_xyz.append([x, y, z])
-            points_i.append([i, i, i])
+    o3d_cloud = o3d.geometry.PointCloud()
+    o3d_cloud.points = o3d.utility.Vector3dVector(points_xyz)
+    o3d_cloud.colors = o3d.utility.Vector3dVector(points_i)
+    o3d.io.write_point_cloud(filename, o3d_cloud)
 
-        points_xyz = np.asarray(points_xyz)
-        points_i = (np.asarray(points_i) / max_intensity).clip(0.0, 1.0)
-        assert points_xyz.shape == points_i.shape, "Dimension Missmatch"
 
-        filename = out_dir + str(idx).zfill(6) + ".ply"
-        o3d_cloud = o3d.geometry.PointCloud()
-        o3d_cloud.points = o3d.utility.Vector3dVector(points_xyz)
-        o3d_cloud.colors = o3d.utility.Vector3dVector(points_i)
-        o3d.io.write_point_cloud(filename, o3d_cloud)
+def convert_bag_to_ply(bag, topic, out_dir, n_workers=None):
+    bag_msgs = bag.read_messages(topics=[topic])
+    msg_count = bag.get_message_count(topic)
+    jobs = (
+        ((msg,), out_dir + str(idx).zfill(6) + ".ply")
+        for idx, (_, msg, _) in enumerate(bag_msgs)
+    )
+    convert_files(msg2ply, jobs, msg_count, n_workers)
 
 
 @click.command()
@@ -54,17 +50,27 @@ def convert_bag_to_ply(bag, topic, out_dir):
     default="results/",
     help="Where to store the results",
 )
-def main(bagfile, topic, out_dir):
+@click.option(
+    "--n_workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of conversion processes, one per CPU by default",
+)
+def main(bagfile, topic, out_dir, n_workers):
     """Convert a .bag file into multiple .ply files, one for each scan,
     including intensity information encoded on the color channel of the
-    PointCloud. We use Open3D to convert the data from ROS to
-    o3d.geometry.PointCloud.
+    PointCloud. The PointCloud2 buffers are decoded with NumPy, see
+    puma.utils.read_points_array, and written with Open3D.
 
     To run it, start this script, then launch the rosbag file. Make sure you
     pass the right option to this script to select the point cloud topic.
 
     \b
     $ ./ros2ply.py --topic /points output.bag
+
+    The scans already converted are skipped, so an interrupted conversion can
+    be resumed by running the same command again.
     """
     print("Saving results to", out_dir)
     os.makedirs(out_dir, exist_ok=True)
@@ -73,7 +79,7 @@ def main(bagfile, topic, out_dir):
         'topic: "' + topic + '" is not recorded in: ' + bagfile
     )
 
-    convert_bag_to_ply(bag, topic, out_dir)
+    convert_bag_to_ply(bag, topic, out_dir, n_workers)
     bag.close()
 
 
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import glob
 import os
 from pathlib import Path
 
@@ -9,7 +8,8 @@ import open3d as o3d
 import pykitti
 from tqdm import tqdm
 
-from puma.preprocessing import preprocess_cloud
+from puma.datasets import load_sequence
+from puma.preprocessing import preprocess_batches
 
 
 @click.command()
@@ -47,7 +47,16 @@ from puma.preprocessing import preprocess_cloud
     default=None,
     help="Which normal computation to use",
 )
-def main(dataset, out_dir, sequence, n_scans, start, visualize, normals):
+@click.option(
+    "--batch_size",
+    "-b",
+    type=int,
+    default=32,
+    help="Number of scans processed at once for range image normals",
+)
+def main(
+    dataset, out_dir, sequence, n_scans, start, visualize, normals, batch_size
+):
     """From a set of input PointClouds create one unique aggreated map cloud."""
     o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Info)
     dataset = os.path.join(dataset, "")
@@ -60,19 +69,15 @@ def main(dataset, out_dir, sequence, n_scans, start, visualize, normals):
 
     gt_poses = T_velo_cam @ data.poses @ T_cam_velo
 
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     # Use the whole sequence if -1 is specified
-    n_scans = len(scan_names) if n_scans == -1 else n_scans
-    print("Processing " + str(n_scans) + " in " + scans)
+    n_scans = len(scans) if n_scans == -1 else n_scans
+    print("Processing " + str(n_scans) + " in " + dataset)
     cloud_map = o3d.geometry.PointCloud()
-    for idx in tqdm(range(start, start + n_scans)):
-        source = preprocess_cloud(
-            o3d.io.read_point_cloud(scan_names[idx]),
-            normals=normals,
-        )
-
+    indices = range(start, start + n_scans)
+    batches = preprocess_batches(scans, indices, normals, batch_size)
+    for idx, source in tqdm(batches, total=n_scans):
         source.transform(gt_poses[idx])
         cloud_map += source
 
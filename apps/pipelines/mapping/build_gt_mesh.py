@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import glob
 import os
 from pathlib import Path
 
@@ -10,8 +9,9 @@ import open3d as o3d
 import pykitti
 from tqdm import tqdm
 
-from puma.mesh import run_poisson
-from puma.preprocessing import preprocess_cloud
+from puma.datasets import load_sequence
+from puma.mesh import run_poisson, run_tiled_poisson
+from puma.preprocessing import preprocess_batches
 
 
 @click.command()
@@ -55,6 +55,13 @@ from puma.preprocessing import preprocess_cloud
     default="range_image",
     help="Which normal computation to use",
 )
+@click.option(
+    "--batch_size",
+    "-b",
+    type=int,
+    default=32,
+    help="Number of scans processed at once for range image normals",
+)
 @click.option(
     "--min_density",
     "-md",
@@ -62,6 +69,25 @@ from puma.preprocessing import preprocess_cloud
     default=0.1,
     help="The minimun vertex density of the final mesh",
 )
+@click.option(
+    "--tile_size",
+    type=float,
+    default=None,
+    help="Run PSR independently on tiles of this size [m], in parallel",
+)
+@click.option(
+    "--overlap",
+    type=float,
+    default=10.0,
+    help="Overlap between tiles [m], only used with --tile_size",
+)
+@click.option(
+    "--n_workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of tiles meshed in parallel, one per CPU by default",
+)
 def main(
     dataset,
     out_dir,
@@ -71,7 +97,11 @@ def main(
     depth,
     visualize,
     normals,
+    batch_size,
     min_density,
+    tile_size,
+    overlap,
+    n_workers,
 ):
     """This script can be used to create GT mesh-model maps using GT poses. It
     assumes you have the data in the kitti-like format and all the scans where
@@ -99,7 +129,15 @@ def main(
 
     \b
     $ ./build_gt_mesh.py -d $DATASETS/kitti/ply/ -s 00 -n 200 --depth 10
+
+    For full sequences, --tile_size splits the map in overlapping tiles which
+    are meshed in parallel, see run_tiled_poisson.
     """
+    # Fail before reading the whole sequence, see plan_tiles
+    if tile_size and not 2 * overlap < tile_size:
+        raise click.BadParameter(
+            "must be below --tile_size / 2", param_hint="--overlap"
+        )
     dataset = os.path.join(dataset, "")
     dataset_name = Path(dataset).parent.name
 
@@ -108,25 +146,27 @@ def main(
     T_velo_cam = np.linalg.inv(T_cam_velo)
     gt_poses = T_velo_cam @ data.poses @ T_cam_velo
 
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     # Use the whole sequence if -1 is specified
-    n_scans = len(scan_names) if n_scans == -1 else n_scans
-    print("Processing " + str(n_scans) + " scans in " + scans)
+    n_scans = len(scans) if n_scans == -1 else n_scans
+    print("Processing " + str(n_scans) + " scans in " + dataset)
     cloud_map = o3d.geometry.PointCloud()
-    for idx in tqdm(range(start, start + n_scans)):
-        source = preprocess_cloud(
-            o3d.io.read_point_cloud(scan_names[idx]),
-            normals=normals,
-        )
+    indices = range(start, start + n_scans)
+    batches = preprocess_batches(scans, indices, normals, batch_size)
+    for idx, source in tqdm(batches, total=n_scans):
         source.transform(gt_poses[idx])
         cloud_map += source
 
     print("Running Poisson Surface Reconstruction, go grab a coffee")
     o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Debug)
 
-    mesh, _ = run_poisson(cloud_map, depth, -1, min_density)
+    if tile_size:
+        mesh = run_tiled_poisson(
+            cloud_map, depth, tile_size, overlap, min_density, n_workers
+        )
+    else:
+        mesh, _ = run_poisson(cloud_map, depth, -1, min_density)
     map_name = (
         "gt_"
         + dataset_name
@@ -139,6 +179,7 @@ def main(
         + "_"
         + normals
     )
+    map_name += "_tiled_" + str(tile_size) if tile_size else ""
     mesh_file = os.path.join(out_dir, map_name + "_mesh.ply")
     print("Saving mesh to " + mesh_file)
     o3d.io.write_triangle_mesh(mesh_file, mesh)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import csv
-import glob
 import os
 from collections import deque
 from pathlib import Path
@@ -9,17 +8,62 @@ from pathlib import Path
 import click
 import numpy as np
 import open3d as o3d
-
-from puma.mesh import create_mesh_from_map, get_mesh_size_mb
-from puma.preprocessing import preprocess
+from tqdm import tqdm
+
+from puma.datasets import load_sequence
+from puma.mesh import (
+    ChunkedMesh,
+    create_mesh_from_map,
+    mesh_from_arrays,
+    mesh_to_arrays,
+)
+from puma.preprocessing import prefetch_scans, preprocess_scan
 from puma.utils import (
     get_progress_bar,
     load_config_from_yaml,
     load_kitti_gt_poses,
+    prefetch,
     print_progress,
 )
 
 
+def plan_windows(n_scans, acc_frame_count, acc_map_count):
+    """Replay the counters of the scan loop in main. Returns the indices of
+    the scans of each PSR window, and for each update of the global map the
+    frame it happens at and the number of windows meshed by then."""
+    windows, map_updates = [], []
+    scan_count = 0
+    map_count = 0
+    for idx in range(1, n_scans):
+        scan_count += 1
+        if scan_count >= acc_frame_count or idx == n_scans - 1:
+            scan_count = 0
+            first = max(1, idx - acc_frame_count + 1)
+            windows.append(list(range(first, idx + 1)))
+
+        map_count += 1
+        if map_count >= acc_map_count or idx == n_scans - 1:
+            map_count = 0
+            map_updates.append((idx, len(windows)))
+    return windows, map_updates
+
+
+def mesh_window(job):
+    """Read, preprocess and mesh the scans of one window in a worker
+    process. The windows are independent since the poses are known."""
+    dataset, sequence, indices, poses, config, n_threads = job
+    scans = load_sequence(dataset, sequence)
+    local_map = []
+    for idx, pose in zip(indices, poses):
+        scan = preprocess_scan(scans, idx, config)
+        scan.transform(pose)
+        local_map.append(scan)
+    mesh, _ = create_mesh_from_map(
+        local_map, config.depth, n_threads, config.min_density
+    )
+    return mesh_to_arrays(mesh)
+
+
 @click.command()
 @click.option("--config", "-c", default="config/puma.yml")
 @click.option(
@@ -33,10 +77,23 @@ from puma.utils import (
     "--n_scans", "-n", type=int, default=-1, help="Number of scans to integrate"
 )
 @click.option("--sequence", "-s", type=str, default="00")
-def main(config, dataset, n_scans, sequence):
+@click.option(
+    "--n_workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Mesh this many windows in parallel instead of one after another",
+)
+def main(config, dataset, n_scans, sequence, n_workers):
     """Similar to the slam/puma_pipeline.py but uses GT poses intead of
     estimate the ego-motion of the vehivle. Build an incremental map using
-    the same technique used in the original puma pipeline."""
+    the same technique used in the original puma pipeline.
+
+    Since the poses are known, the PSR windows do not depend on each other.
+    With --n_workers all the windows are planned up front and meshed on a
+    pool of processes, each one with its share of the cores, and merged in
+    order into the same map.
+    """
     config = load_config_from_yaml(config)
     dataset = os.path.join(dataset, "")
     os.makedirs(config.out_dir, exist_ok=True)
@@ -52,15 +109,18 @@ def main(config, dataset, n_scans, sequence):
     poses_file = os.path.join(config.out_dir, poses_file)
     print("Results will be saved to", poses_file)
 
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     # Create data containers to store the map
     mesh = o3d.geometry.TriangleMesh()
 
     # Create a circular buffer, the same way we do in the C++ implementation
     local_map = deque(maxlen=config.acc_frame_count)
-    global_mesh = o3d.geometry.TriangleMesh()
+    global_mesh = ChunkedMesh(
+        config.get("chunk_size", 50.0),
+        config.out_dir,
+        config.get("resident_radius"),
+    )
 
     poses = [np.eye(4, 4, dtype=np.float64)]
 
@@ -71,41 +131,69 @@ def main(config, dataset, n_scans, sequence):
     csv_writer = csv.writer(csv_file, delimiter=" ", lineterminator="\n")
     csv_writer.writerow(["frames", "vertices", "triangles", "size"])
 
-    # Start the mapping pipeline
-    scan_count = 0
-    map_count = 0
-    pbar = get_progress_bar(1, n_scans)
-    for idx in pbar:
-        str_size = print_progress(pbar, idx, n_scans)
-        scan = preprocess(o3d.io.read_point_cloud(scan_names[idx]), config)
-        poses.append(gt_poses[idx])
-        scan.transform(poses[-1])
-        local_map.append(scan)
-
-        scan_count += 1
-        if scan_count >= config.acc_frame_count or idx == n_scans - 1:
-            scan_count = 0
-            msg = "[scan #{}] Running PSR over local_map".format(idx)
-            pbar.set_description(msg.rjust(str_size))
-            mesh, _ = create_mesh_from_map(
-                local_map, config.depth, config.n_threads, config.min_density
-            )
-
-        map_count += 1
-        if map_count >= config.acc_map_count or idx == n_scans - 1:
-            map_count = 0
-            global_mesh += mesh
-            global_mesh = global_mesh.remove_duplicated_triangles()
-            global_mesh = global_mesh.remove_duplicated_vertices()
-            vertices = len(global_mesh.vertices)
-            triangles = len(global_mesh.triangles)
-            size_mb = get_mesh_size_mb(global_mesh)
+    if n_workers:
+        windows, map_updates = plan_windows(
+            n_scans, config.acc_frame_count, config.acc_map_count
+        )
+        n_threads = max(1, os.cpu_count() // n_workers)
+        jobs = (
+            (dataset, sequence, window, gt_poses[window], config, n_threads)
+            for window in windows
+        )
+        meshes = prefetch(
+            mesh_window, jobs, n_workers, n_workers, processes=True
+        )
+        n_meshed = 0
+        for idx, n_windows in tqdm(map_updates, unit=" updates"):
+            while n_meshed < n_windows:
+                mesh = mesh_from_arrays(*next(meshes))
+                n_meshed += 1
+            global_mesh.add(mesh)
+            global_mesh.evict(gt_poses[idx][:3, 3])
+            vertices = global_mesh.n_vertices
+            triangles = global_mesh.n_triangles
+            size_mb = global_mesh.get_size_mb()
             csv_writer.writerow([idx, vertices, triangles, size_mb])
+    else:
+        # Start the mapping pipeline
+        scan_count = 0
+        map_count = 0
+        pbar = get_progress_bar(1, n_scans)
+        scan_stream = prefetch_scans(scans, range(1, n_scans), config)
+        for idx, scan in zip(pbar, scan_stream):
+            str_size = print_progress(pbar, idx, n_scans)
+            poses.append(gt_poses[idx])
+            scan.transform(poses[-1])
+            local_map.append(scan)
+
+            scan_count += 1
+            if scan_count >= config.acc_frame_count or idx == n_scans - 1:
+                scan_count = 0
+                msg = "[scan #{}] Running PSR over local_map".format(idx)
+                pbar.set_description(msg.rjust(str_size))
+                mesh, _ = create_mesh_from_map(
+                    local_map,
+                    config.depth,
+                    config.n_threads,
+                    config.min_density,
+                )
+
+            map_count += 1
+            if map_count >= config.acc_map_count or idx == n_scans - 1:
+                map_count = 0
+                global_mesh.add(mesh)
+                global_mesh.evict(poses[-1][:3, 3])
+                vertices = global_mesh.n_vertices
+                triangles = global_mesh.n_triangles
+                size_mb = global_mesh.get_size_mb()
+                csv_writer.writerow([idx, vertices, triangles, size_mb])
 
     # Save map to file
     mesh_map_file = os.path.join(config.out_dir, map_name + ".ply")
     print("Saving Map to", mesh_map_file)
-    o3d.io.write_triangle_mesh(mesh_map_file, global_mesh)
+    vertices, triangles = global_mesh.write_ply(mesh_map_file)
+    global_mesh.close()
+    print("Map has {} vertices, {} triangles".format(vertices, triangles))
     csv_file.close()
 
 
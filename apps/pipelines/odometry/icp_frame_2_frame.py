@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 
-import glob
 import os
 from pathlib import Path
 
 import click
 import numpy as np
 import open3d as o3d
-from tqdm import trange
+from tqdm import tqdm
 
-from puma.preprocessing import preprocess
+from puma.datasets import load_sequence
+from puma.preprocessing import prefetch_scans, preprocess_scan
 from puma.registration import run_icp
 from puma.utils import (
     load_config_from_yaml,
@@ -19,12 +19,6 @@ from puma.utils import (
 )
 
 
-def get_scan_names(dataset):
-    dataset = os.path.join(dataset, "")
-    scan_names = sorted(glob.glob(dataset + "*.ply"))
-    return scan_names
-
-
 @click.command()
 @click.option("--config", "-c", default="config/p2p_icp.yml")
 @click.option(
@@ -46,7 +40,6 @@ def main(config, dataset, n_scans, start_scan, sequence):
         o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Debug)
     dname = Path(dataset).parent.name
     approach = Path(dataset).name
-    dataset = os.path.join(dataset, "sequences", sequence, "velodyne", "")
     map_name = dname + "_" + sequence + "_"
     map_name += config.method + "_frame2frame_icp"
 
@@ -67,17 +60,17 @@ def main(config, dataset, n_scans, start_scan, sequence):
     deltas = [np.eye(4, 4, dtype=np.float64)]
 
     # Get dataset
-    scan_names = get_scan_names(dataset)
+    scans = load_sequence(dataset, sequence)
 
     # Use the whole sequence if -1 is specified
     if n_scans == -1:
-        n_scans = len(scan_names)
+        n_scans = len(scans)
 
     print("Processing " + str(n_scans) + " in " + dataset)
-    target = preprocess(o3d.io.read_point_cloud(scan_names[0]), config)
-    for idx in trange(start_scan + 1, start_scan + n_scans):
-        source = preprocess(o3d.io.read_point_cloud(scan_names[idx]), config)
-
+    target = preprocess_scan(scans, 0, config)
+    scan_ids = range(start_scan + 1, start_scan + n_scans)
+    scan_stream = prefetch_scans(scans, scan_ids, config)
+    for source in tqdm(scan_stream, total=len(scan_ids)):
         # Run ICP
         initial_guess = deltas[-1] if config.warm_start else np.eye(4)
         pose = run_icp(source, target, initial_guess, config)
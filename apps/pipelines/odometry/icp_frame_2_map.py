@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import glob
 import os
 from collections import deque
 from pathlib import Path
@@ -9,7 +8,8 @@ import click
 import numpy as np
 import open3d as o3d
 
-from puma.preprocessing import preprocess
+from puma.datasets import load_sequence
+from puma.preprocessing import prefetch_scans, preprocess_scan
 from puma.registration import run_icp
 from puma.utils import (
     buffer_to_pointcloud,
@@ -53,8 +53,7 @@ def main(config, dataset, sequence, n_scans, start):
     if config.debug:
         o3d.utility.set_verbosity_level(o3d.utility.VerbosityLevel.Debug)
     dataset = os.path.join(dataset, "")
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     os.makedirs(config.out_dir, exist_ok=True)
     map_name = get_map_name(config, dataset, sequence)
@@ -68,24 +67,25 @@ def main(config, dataset, sequence, n_scans, start):
 
     # Use the whole sequence if -1 is specified
     if n_scans == -1:
-        n_scans = len(scan_names) - start
+        n_scans = len(scans) - start
 
     first_scan_id = start
     last_scan_id = start + n_scans
 
-    print("Processing " + str(n_scans) + " scans in " + scans)
+    print("Processing " + str(n_scans) + " scans in " + dataset)
     poses = [np.eye(4, 4, dtype=np.float64)]
     deltas = [np.eye(4, 4, dtype=np.float64)]
 
-    first_scan = preprocess(o3d.io.read_point_cloud(scan_names[0]), config)
+    first_scan = preprocess_scan(scans, 0, config)
     local_map = deque(maxlen=config.acc_frame_count)
     local_map.append(first_scan)
 
     # Start the mapping pipeline
     pbar = get_progress_bar(first_scan_id + 1, last_scan_id)
-    for idx in pbar:
+    scan_ids = range(first_scan_id + 1, last_scan_id)
+    scan_stream = prefetch_scans(scans, scan_ids, config)
+    for idx, scan in zip(pbar, scan_stream):
         print_progress(pbar, idx, n_scans)
-        scan = preprocess(o3d.io.read_point_cloud(scan_names[idx]), config)
         # The target model is the local map that is used on the PSR pipeline but
         # running standard ICP.
         target = buffer_to_pointcloud(local_map)
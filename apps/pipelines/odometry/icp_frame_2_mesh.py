@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import copy
-import glob
 import os
 from collections import deque
 from pathlib import Path
@@ -10,8 +9,9 @@ import click
 import numpy as np
 import open3d as o3d
 
+from puma.datasets import load_sequence
 from puma.mesh import create_mesh_from_map
-from puma.preprocessing import preprocess
+from puma.preprocessing import prefetch_scans, preprocess_scan
 from puma.registration import register_scan_to_mesh, run_icp
 from puma.utils import (
     get_progress_bar,
@@ -59,35 +59,41 @@ def main(config, dataset, n_scans, sequence):
     poses_file = os.path.join(config.out_dir, poses_file)
     print("Results will be saved to", poses_file)
 
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     # Use the whole sequence if -1 is specified
-    n_scans = len(scan_names) if n_scans == -1 else n_scans
+    n_scans = len(scans) if n_scans == -1 else n_scans
 
     # Create data containers to store the map
     mesh = o3d.geometry.TriangleMesh()
+    mesh_version = 0
 
     # Create a circular buffer, the same way we do in the C++ implementation
     local_map = deque(maxlen=config.acc_frame_count)
 
     poses = [np.eye(4, 4, dtype=np.float64)]
     deltas = [np.eye(4, 4, dtype=np.float64)]
-    last_scan = preprocess(o3d.io.read_point_cloud(scan_names[0]), config)
+    last_scan = preprocess_scan(scans, 0, config)
 
     # Start the Odometry and Mapping pipeline
     scan_count = 0
     pbar = get_progress_bar(1, n_scans)
-    for idx in pbar:
+    scan_stream = prefetch_scans(scans, range(1, n_scans), config)
+    for idx, scan in zip(pbar, scan_stream):
         str_size = print_progress(pbar, idx, n_scans)
-        scan = preprocess(o3d.io.read_point_cloud(scan_names[idx]), config)
         initial_guess = deltas[-1].copy() if config.warm_start else np.eye(4)
         if mesh.has_vertices():
             msg = "[scan #{}] Registering scan to mesh model".format(idx)
             pbar.set_description(msg.rjust(str_size))
-            mesh.transform(np.linalg.inv(poses[-1]))
             pose = register_scan_to_mesh(
-                scan, mesh, initial_guess, deltas, last_scan, config
+                scan,
+                mesh,
+                initial_guess,
+                deltas,
+                last_scan,
+                config,
+                mesh_version=mesh_version,
+                sensor_pose=poses[-1],
             )
         else:
             pose = run_icp(scan, last_scan, initial_guess, config)
@@ -105,6 +111,7 @@ def main(config, dataset, n_scans, sequence):
             mesh, _ = create_mesh_from_map(
                 local_map, config.depth, config.n_threads, config.min_density
             )
+            mesh_version += 1
 
 
 if __name__ == "__main__":
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import copy
-import glob
 import os
 from collections import deque
 from pathlib import Path
@@ -9,8 +8,9 @@ import click
 import numpy as np
 import open3d as o3d
 
-from puma.mesh import create_mesh_from_map
-from puma.preprocessing import preprocess
+from puma.datasets import load_sequence
+from puma.mesh import BackgroundMesher, ChunkedMesh
+from puma.preprocessing import prefetch_scans, preprocess_scan
 from puma.registration import register_scan_to_mesh, run_icp
 from puma.utils import (
     get_progress_bar,
@@ -105,40 +105,60 @@ def main(config, dataset, n_scans, sequence, odometry_only):
     poses_file = os.path.join(config.out_dir, poses_file)
     print("Results will be saved to", poses_file)
 
-    scans = os.path.join(dataset, "sequences", sequence, "velodyne", "")
-    scan_names = sorted(glob.glob(scans + "*.ply"))
+    scans = load_sequence(dataset, sequence)
 
     # Use the whole sequence if -1 is specified
-    n_scans = len(scan_names) if n_scans == -1 else n_scans
+    n_scans = len(scans) if n_scans == -1 else n_scans
 
     # Create data containers to store the map
     mesh = o3d.geometry.TriangleMesh()
+    mesh_version = 0
+    # Tickets of the last submitted local map and of the one being tracked
+    ticket, mesh_ticket = None, None
+    mesher = BackgroundMesher(
+        config.depth,
+        config.n_threads,
+        config.min_density,
+        config.get("meshing", "sync"),
+    )
 
     # Create a circular buffer, the same way we do in the C++ implementation
     local_map = deque(maxlen=config.acc_frame_count)
 
     # Mapping facilities
-    global_mesh = o3d.geometry.TriangleMesh()
+    global_mesh = ChunkedMesh(
+        config.get("chunk_size", 50.0),
+        config.out_dir,
+        config.get("resident_radius"),
+    )
     mapping_enabled = not odometry_only
+    # Local maps whose mesh goes to the global map as soon as it is ready
+    map_tickets = set()
 
     poses = [np.eye(4, 4, dtype=np.float64)]
     deltas = [np.eye(4, 4, dtype=np.float64)]
-    last_scan = preprocess(o3d.io.read_point_cloud(scan_names[0]), config)
+    last_scan = preprocess_scan(scans, 0, config)
 
     # Start the Odometry and Mapping pipeline
     scan_count = 0
     map_count = 0
     pbar = get_progress_bar(1, n_scans)
-    for idx in pbar:
+    scan_stream = prefetch_scans(scans, range(1, n_scans), config)
+    for idx, scan in zip(pbar, scan_stream):
         str_size = print_progress(pbar, idx, n_scans)
-        scan = preprocess(o3d.io.read_point_cloud(scan_names[idx]), config)
         initial_guess = deltas[-1].copy() if config.warm_start else np.eye(4)
         if mesh.has_vertices():
             msg = "[scan #{}] Registering scan to mesh model".format(idx)
             pbar.set_description(msg.rjust(str_size))
-            mesh.transform(np.linalg.inv(poses[-1]))
             pose = register_scan_to_mesh(
-                scan, mesh, initial_guess, deltas, last_scan, config
+                scan,
+                mesh,
+                initial_guess,
+                deltas,
+                last_scan,
+                config,
+                mesh_version=mesh_version,
+                sensor_pose=poses[-1],
             )
         else:
             pose = run_icp(scan, last_scan, initial_guess, config)
@@ -153,23 +173,35 @@ def main(config, dataset, n_scans, sequence, odometry_only):
             save_poses(poses_file, vel2cam(poses))
             msg = "[scan #{}] Running PSR over local_map".format(idx)
             pbar.set_description(msg.rjust(str_size))
-            mesh, _ = create_mesh_from_map(
-                local_map, config.depth, config.n_threads, config.min_density
-            )
+            ticket = mesher.submit(local_map)
+
+        # Swap in the new local meshes, if any, between 2 frames
+        for mesh_ticket, mesh in mesher.poll(wait=idx == n_scans - 1):
+            mesh_version += 1
+            if mesh_ticket in map_tickets:
+                map_tickets.remove(mesh_ticket)
+                global_mesh.add(mesh)
+                global_mesh.evict(poses[-1][:3, 3])
 
         if mapping_enabled:
             map_count += 1
             if map_count >= config.acc_map_count or idx == n_scans - 1:
                 map_count = 0
-                global_mesh += mesh
-                global_mesh = global_mesh.remove_duplicated_triangles()
-                global_mesh = global_mesh.remove_duplicated_vertices()
-
+                if ticket != mesh_ticket:
+                    # The PSR of the latest local map is still running
+                    mesher.retain(ticket)
+                    map_tickets.add(ticket)
+                else:
+                    global_mesh.add(mesh)
+                    global_mesh.evict(poses[-1][:3, 3])
+
+    mesher.close()
     if mapping_enabled:
         # Save map to file
         mesh_map_file = os.path.join(config.out_dir, map_name + ".ply")
         print("Saving Map to", mesh_map_file)
-        o3d.io.write_triangle_mesh(mesh_map_file, global_mesh)
+        global_mesh.write_ply(mesh_map_file)
+        global_mesh.close()
 
 
 if __name__ == "__main__":
@@ -3,6 +3,11 @@
 #include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 
+#include <algorithm>
+#include <cmath>
+#include <stdexcept>
+#include <vector>
+
 namespace py = pybind11;
 
 int wrap(int x, int dim) {
@@ -16,6 +21,68 @@ int wrap(int x, int dim) {
     return value;
 }
 
+// Compute the normal at pixel (x, y) of the vertex map from its right and
+// bottom neighbours. The normal is left untouched if any of them is missing.
+inline void pixel_normal(const float *depth_buffer,
+                         const float *vertex_map,
+                         float *normal_map,
+                         const int W,
+                         const int x,
+                         const int y) {
+    const float &px = vertex_map[y * W * 3 + x * 3];
+    const float &py = vertex_map[y * W * 3 + x * 3 + 1];
+    const float &pz = vertex_map[y * W * 3 + x * 3 + 2];
+    const float &depth = depth_buffer[y * W + x];
+    if (!(depth > 0)) {
+        return;
+    }
+
+    int wrap_x = wrap(x + 1, W);
+    const float &ux = vertex_map[y * W * 3 + wrap_x * 3];
+    const float &uy = vertex_map[y * W * 3 + wrap_x * 3 + 1];
+    const float &uz = vertex_map[y * W * 3 + wrap_x * 3 + 2];
+    const float &u_depth = depth_buffer[y * W + wrap_x];
+    if (u_depth <= 0) {
+        return;
+    }
+
+    const float &vx = vertex_map[(y + 1) * W * 3 + x * 3];
+    const float &vy = vertex_map[(y + 1) * W * 3 + x * 3 + 1];
+    const float &vz = vertex_map[(y + 1) * W * 3 + x * 3 + 2];
+    const float &v_depth = depth_buffer[(y + 1) * W + x];
+    if (v_depth <= 0) {
+        return;
+    }
+
+    float l = 0.0;
+    float u_normx = ux - px;
+    float u_normy = uy - py;
+    float u_normz = uz - pz;
+    l = sqrt(u_normx * u_normx + u_normy * u_normy + u_normz * u_normz);
+    u_normx /= l;
+    u_normy /= l;
+    u_normz /= l;
+
+    float v_normx = vx - px;
+    float v_normy = vy - py;
+    float v_normz = vz - pz;
+    l = sqrt(v_normx * v_normx + v_normy * v_normy + v_normz * v_normz);
+    v_normx /= l;
+    v_normy /= l;
+    v_normz /= l;
+
+    const float crossx = u_normz * v_normy - u_normy * v_normz;
+    const float crossy = u_normx * v_normz - u_normz * v_normx;
+    const float crossz = u_normy * v_normx - u_normx * v_normy;
+    float norm = sqrt(crossx * crossx + crossy * crossy + crossz * crossz);
+
+    if (norm > 0) {
+        normal_map[y * W * 3 + x * 3] = crossx / norm;
+        normal_map[y * W * 3 + x * 3 + 1] = crossy / norm;
+        normal_map[y * W * 3 + x * 3 + 2] = crossz / norm;
+    }
+}
+
 py::array_t<float> gen_normal_map(const py::array_t<float> &range,
                                   const py::array_t<float> &vertex,
                                   const int W,
@@ -32,84 +99,214 @@ py::array_t<float> gen_normal_map(const py::array_t<float> &range,
     auto *vertex_map = (float *)buf2.ptr;
     auto *normal_map = (float *)buf3.ptr;
 
+    {
+        // Only plain buffers from here, let other Python threads run
+        py::gil_scoped_release release;
+
+#pragma omp parallel for
+        for (int i = 0; i < H * W * 3; ++i) {
+            normal_map[i] = 0;
+        }
+
+#pragma omp parallel for collapse(2)
+        for (int x = 0; x < W; ++x) {
+            for (int y = 0; y < H - 1; ++y) {
+                pixel_normal(depth_buffer, vertex_map, normal_map, W, x, y);
+            }
+        }
+    }
+
+    // reshape array to match input shape
+    normal_map_buffer.resize({H, W, 3});
+    return normal_map_buffer;
+}
+
+// Batched version of gen_normal_map, for a (B, H, W) stack of range images
+// and their (B, H, W, 3) vertex maps. The normals are written to the given
+// (B, H, W, 3) output buffer, so it can be reused from batch to batch.
+void gen_normal_maps(
+    const py::array_t<float, py::array::c_style | py::array::forcecast>
+        &range,
+    const py::array_t<float, py::array::c_style | py::array::forcecast>
+        &vertex,
+    py::array_t<float, py::array::c_style> &normals) {
+    if (range.ndim() != 3 || vertex.ndim() != 4 || normals.ndim() != 4) {
+        throw std::invalid_argument(
+            "Expected (B, H, W) ranges, (B, H, W, 3) vertices and normals");
+    }
+    const int B = range.shape(0);
+    const int H = range.shape(1);
+    const int W = range.shape(2);
+    for (int i = 0; i < 3; ++i) {
+        if (vertex.shape(i) != range.shape(i) ||
+            normals.shape(i) != range.shape(i)) {
+            throw std::invalid_argument("Mismatching batch dimensions");
+        }
+    }
+    if (vertex.shape(3) != 3 || normals.shape(3) != 3) {
+        throw std::invalid_argument("Vertices and normals must be 3D");
+    }
+
+    const float *depth_buffer = range.data();
+    const float *vertex_map = vertex.data();
+    float *normal_map = normals.mutable_data();
+    // Only plain buffers from here, let other Python threads run
+    py::gil_scoped_release release;
+
 #pragma omp parallel for
-    for (int i = 0; i < H * W * 3; ++i) {
+    for (long i = 0; i < long(B) * H * W * 3; ++i) {
         normal_map[i] = 0;
     }
 
-#pragma omp parallel
+#pragma omp parallel for collapse(3)
+    for (int b = 0; b < B; ++b) {
+        for (int x = 0; x < W; ++x) {
+            for (int y = 0; y < H - 1; ++y) {
+                const long offset = long(b) * H * W;
+                pixel_normal(depth_buffer + offset, vertex_map + 3 * offset,
+                             normal_map + 3 * offset, W, x, y);
+            }
+        }
+    }
+}
+
+// Fused version of project_to_range_image + gen_normal_map +
+// remove_non_finite_points. Takes the raw (N, 3) points of a scan and returns
+// the (M, 3) points kept in the range image and their normals, in row-major
+// pixel order. Points without valid neighbours get a zero normal.
+py::tuple gen_normals_from_points(
+    const py::array_t<double, py::array::c_style | py::array::forcecast>
+        &points,
+    const int W,
+    const int H,
+    const double fov_up_deg,
+    const double fov_down_deg,
+    const double max_range) {
+    const int N = points.shape(0);
+    const double *xyz = points.data();
+    std::vector<float> out_points;
+    std::vector<float> out_normals;
+
+    // The whole computation runs on plain buffers, without the GIL. The
+    // NumPy outputs are only allocated once it is reacquired
     {
-#pragma omp for nowait collapse(2)
+        py::gil_scoped_release release;
+
+        const double fov_up = fov_up_deg / 180.0 * M_PI;
+        const double fov_down = fov_down_deg / 180.0 * M_PI;
+        const double fov = std::abs(fov_down) + std::abs(fov_up);
+
+        // Spherical projection of each point
+        std::vector<int> pixel(N);
+        std::vector<float> depth(N);
+#pragma omp parallel for
+        for (int i = 0; i < N; ++i) {
+            const double x = xyz[3 * i];
+            const double y = xyz[3 * i + 1];
+            const double z = xyz[3 * i + 2];
+            const double d = std::sqrt(x * x + y * y + z * z);
+            if (!(d > 0 && d < max_range)) {
+                pixel[i] = -1;
+                continue;
+            }
+            const double yaw = -std::atan2(y, x);
+            const double pitch =
+                std::asin(std::min(std::max(z / d, -1.0), 1.0));
+            const double u = 0.5 * (yaw / M_PI + 1.0) * W;
+            const double v = (1.0 - (pitch + std::abs(fov_down)) / fov) * H;
+            const int proj_x = std::min(std::max(std::floor(u), 0.0), W - 1.0);
+            const int proj_y = std::min(std::max(std::floor(v), 0.0), H - 1.0);
+            pixel[i] = proj_y * W + proj_x;
+            depth[i] = static_cast<float>(d);
+        }
+
+        // z-buffer, the closest point of each pixel wins(the last one on ties)
+        std::vector<float> range_image(H * W, NAN);
+        std::vector<int> winner(H * W, -1);
+        for (int i = 0; i < N; ++i) {
+            const int p = pixel[i];
+            if (p >= 0 && (winner[p] < 0 || depth[i] <= range_image[p])) {
+                range_image[p] = depth[i];
+                winner[p] = i;
+            }
+        }
+
+        std::vector<float> vertex_map(H * W * 3, NAN);
+        std::vector<float> normal_map(H * W * 3, 0.0f);
+#pragma omp parallel for
+        for (int p = 0; p < H * W; ++p) {
+            if (winner[p] >= 0) {
+                const double *point = xyz + 3 * winner[p];
+                for (int c = 0; c < 3; ++c) {
+                    vertex_map[3 * p + c] = static_cast<float>(point[c]);
+                }
+            }
+        }
+
+#pragma omp parallel for collapse(2)
         for (int x = 0; x < W; ++x) {
             for (int y = 0; y < H - 1; ++y) {
-                const float &px = vertex_map[y * W * 3 + x * 3];
-                const float &py = vertex_map[y * W * 3 + x * 3 + 1];
-                const float &pz = vertex_map[y * W * 3 + x * 3 + 2];
-                const float &depth = depth_buffer[y * W + x];
-
-                if (depth > 0) {
-                    int wrap_x = wrap(x + 1, W);
-                    const float &ux = vertex_map[y * W * 3 + wrap_x * 3];
-                    const float &uy = vertex_map[y * W * 3 + wrap_x * 3 + 1];
-                    const float &uz = vertex_map[y * W * 3 + wrap_x * 3 + 2];
-                    const float &u_depth = depth_buffer[y * W + wrap_x];
-                    if (u_depth <= 0) {
-                        continue;
-                    }
-
-                    const float &vx = vertex_map[(y + 1) * W * 3 + x * 3];
-                    const float &vy = vertex_map[(y + 1) * W * 3 + x * 3 + 1];
-                    const float &vz = vertex_map[(y + 1) * W * 3 + x * 3 + 2];
-                    const float &v_depth = depth_buffer[(y + 1) * W + x];
-                    if (v_depth <= 0) {
-                        continue;
-                    }
-
-                    float l = 0.0;
-                    float u_normx = ux - px;
-                    float u_normy = uy - py;
-                    float u_normz = uz - pz;
-                    l = sqrt(u_normx * u_normx + u_normy * u_normy +
-                             u_normz * u_normz);
-                    u_normx /= l;
-                    u_normy /= l;
-                    u_normz /= l;
-
-                    float v_normx = vx - px;
-                    float v_normy = vy - py;
-                    float v_normz = vz - pz;
-                    l = sqrt(v_normx * v_normx + v_normy * v_normy +
-                             v_normz * v_normz);
-                    v_normx /= l;
-                    v_normy /= l;
-                    v_normz /= l;
-
-                    const float crossx = u_normz * v_normy - u_normy * v_normz;
-                    const float crossy = u_normx * v_normz - u_normz * v_normx;
-                    const float crossz = u_normy * v_normx - u_normx * v_normy;
-                    float norm = sqrt(crossx * crossx + crossy * crossy +
-                                      crossz * crossz);
-
-#pragma omp critical
-                    if (norm > 0) {
-                        const float normalx = crossx / norm;
-                        const float normaly = crossy / norm;
-                        const float normalz = crossz / norm;
-                        normal_map[y * W * 3 + x * 3] = normalx;
-                        normal_map[y * W * 3 + x * 3 + 1] = normaly;
-                        normal_map[y * W * 3 + x * 3 + 2] = normalz;
-                    }
+                pixel_normal(range_image.data(), vertex_map.data(),
+                             normal_map.data(), W, x, y);
+            }
+        }
+
+        // Compact the valid pixels, each row is written at its own offset
+        std::vector<int> row_offset(H + 1, 0);
+#pragma omp parallel for
+        for (int y = 0; y < H; ++y) {
+            for (int x = 0; x < W; ++x) {
+                row_offset[y + 1] += winner[y * W + x] >= 0;
+            }
+        }
+        for (int y = 0; y < H; ++y) {
+            row_offset[y + 1] += row_offset[y];
+        }
+
+        out_points.resize(3 * long(row_offset[H]));
+        out_normals.resize(3 * long(row_offset[H]));
+#pragma omp parallel for
+        for (int y = 0; y < H; ++y) {
+            int j = row_offset[y];
+            for (int x = 0; x < W; ++x) {
+                const int p = y * W + x;
+                if (winner[p] < 0) {
+                    continue;
                 }
+                for (int c = 0; c < 3; ++c) {
+                    out_points[3 * j + c] = vertex_map[3 * p + c];
+                    out_normals[3 * j + c] = normal_map[3 * p + c];
+                }
+                ++j;
             }
         }
     }
 
-    // reshape array to match input shape
-    normal_map_buffer.resize({H, W, 3});
-    return normal_map_buffer;
+    const int M = out_points.size() / 3;
+    py::array_t<float> points_out({M, 3});
+    py::array_t<float> normals_out({M, 3});
+    std::copy(out_points.begin(), out_points.end(), points_out.mutable_data());
+    std::copy(out_normals.begin(), out_normals.end(),
+              normals_out.mutable_data());
+    return py::make_tuple(points_out, normals_out);
 }
 
 PYBIND11_MODULE(normal_map, m) {
     m.doc() = "generate normal map using pybind11";
     m.def("gen_normal_map", &gen_normal_map, "generate normal map");
+    m.def("gen_normal_maps",
+          &gen_normal_maps,
+          "generate a batch of normal maps into a given output buffer",
+          py::arg("range"),
+          py::arg("vertex"),
+          py::arg("normals").noconvert());
+    m.def("gen_normals_from_points",
+          &gen_normals_from_points,
+          "project the points and generate their normals in a single pass",
+          py::arg("points"),
+          py::arg("W") = 1024,
+          py::arg("H") = 64,
+          py::arg("fov_up") = 3.0,
+          py::arg("fov_down") = -25.0,
+          py::arg("max_range") = 50.0);
 }
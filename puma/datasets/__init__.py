@@ -0,0 +1,5 @@
+from .kitti import *
+from .packed import *
+from .ply import *
+from .scan_key import *
+from .sequence import *
@@ -0,0 +1,43 @@
+import numpy as np
+import open3d as o3d
+
+from .scan_key import file_key
+
+
+def load_velo_scan(file):
+    """Load and parse a velodyne binary file into a (N, 4) float32 array of
+    x, y, z and intensity, without any extra copy of the data."""
+    scan = np.fromfile(file, dtype=np.float32)
+    return scan.reshape((-1, 4))
+
+
+def vel2ply(points, use_intensity=False):
+    """Convert the (N, 4) array of a velodyne scan to a PointCloud, optionally
+    encoding the intensity value in the color channel."""
+    pcd = o3d.geometry.PointCloud()
+    points_xyz = points[:, :3]
+    pcd.points = o3d.utility.Vector3dVector(points_xyz)
+    if use_intensity:
+        points_i = points[:, -1].reshape(-1, 1)
+        pcd.colors = o3d.utility.Vector3dVector(
+            np.full_like(points_xyz, points_i)
+        )
+    return pcd
+
+
+class BinSequence:
+    """One KITTI velodyne .bin file per scan, read directly without any
+    conversion to .ply."""
+
+    def __init__(self, scan_names, use_intensity=False):
+        self.scan_names = scan_names
+        self.use_intensity = use_intensity
+
+    def __len__(self):
+        return len(self.scan_names)
+
+    def scan_key(self, idx):
+        return file_key(self.scan_names[idx])
+
+    def __getitem__(self, idx):
+        return vel2ply(load_velo_scan(self.scan_names[idx]), self.use_intensity)
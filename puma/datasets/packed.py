@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import open3d as o3d
+
+from .scan_key import file_key
+
+PACKED_SCANS = "scans.f32"
+PACKED_INDEX = "index.npz"
+
+
+class PackedSequence:
+    """A whole sequence packed in one contiguous float32 file, plus an index
+    with the offset of each scan. Each row holds the x, y, z of one point.
+
+    points(i) is a zero-copy view of the memory-mapped file, only the pages
+    actually touched are read from disk. __getitem__ returns a PointCloud
+    like the other sequences.
+    """
+
+    def __init__(self, path):
+        self.scans_file = os.path.join(path, PACKED_SCANS)
+        index = np.load(os.path.join(path, PACKED_INDEX))
+        self.offsets = index["offsets"]
+        self.data = np.memmap(
+            self.scans_file, dtype=np.float32, mode="r"
+        ).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def scan_key(self, idx):
+        return "{}#{}".format(file_key(self.scans_file), idx)
+
+    def points(self, idx):
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __getitem__(self, idx):
+        points = self.points(idx)
+        cloud = o3d.geometry.PointCloud()
+        cloud.points = o3d.utility.Vector3dVector(points.astype(np.float64))
+        return cloud
+
+
+def write_packed_sequence(path, clouds):
+    """Pack the given iterable of PointClouds into path, one after the other
+    in the same order. Returns the number of scans written."""
+    os.makedirs(path, exist_ok=True)
+    offsets = [0]
+    with open(os.path.join(path, PACKED_SCANS), "wb") as scans_file:
+        for cloud in clouds:
+            points = np.asarray(cloud.points, dtype=np.float32)
+            points.tofile(scans_file)
+            offsets.append(offsets[-1] + len(points))
+
+    # The index is written last, a sequence without it is incomplete
+    np.savez(
+        os.path.join(path, PACKED_INDEX),
+        offsets=np.array(offsets, dtype=np.int64),
+    )
+    return len(offsets) - 1
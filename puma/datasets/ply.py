@@ -0,0 +1,101 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+PLY_TYPES = {
+    "char": "i1",
+    "int8": "i1",
+    "uchar": "u1",
+    "uint8": "u1",
+    "short": "i2",
+    "int16": "i2",
+    "ushort": "u2",
+    "uint16": "u2",
+    "int": "i4",
+    "int32": "i4",
+    "uint": "u4",
+    "uint32": "u4",
+    "float": "f4",
+    "float32": "f4",
+    "double": "f8",
+    "float64": "f8",
+}
+
+_vertex_count = re.compile(rb"^element vertex (\d+)$", re.MULTILINE)
+
+
+def read_ply_header(file):
+    """Return the raw header of a PLY file, including the end_header line."""
+    header = b""
+    with open(file, "rb") as ply_file:
+        for line in ply_file:
+            header += line
+            if line.strip() == b"end_header":
+                return header
+    raise ValueError("{} is not a valid PLY file".format(file))
+
+
+@lru_cache(maxsize=16)
+def parse_ply_layout(layout):
+    """Build the NumPy dtype of one vertex from a PLY header without the
+    vertex count, which is the same for all the scans of a sequence.
+
+    Only binary little endian files with the vertex element first and no list
+    properties can be memory-mapped, anything else raises a ValueError.
+    """
+    lines = layout.decode("ascii").splitlines()
+    if "format binary_little_endian 1.0" not in lines:
+        raise ValueError("Only binary little endian PLY files are supported")
+    elements = [line.split() for line in lines if line.startswith("element")]
+    if not elements or elements[0][1] != "vertex":
+        raise ValueError("The vertex element must come first")
+
+    fields = []
+    in_vertex = False
+    for line in lines:
+        tokens = line.split()
+        if tokens[0] == "element":
+            in_vertex = tokens[1] == "vertex"
+        elif tokens[0] == "property" and in_vertex:
+            if tokens[1] == "list" or tokens[1] not in PLY_TYPES:
+                raise ValueError("Unsupported vertex property " + line)
+            fields.append((tokens[2], "<" + PLY_TYPES[tokens[1]]))
+    return np.dtype(fields)
+
+
+def read_ply_vertices(file):
+    """Memory-map the vertex data of a binary PLY file. Returns a structured
+    array with one field per vertex property, without parsing any element."""
+    header = read_ply_header(file)
+    count = _vertex_count.search(header)
+    if count is None:
+        raise ValueError("{} has no vertex element".format(file))
+    dtype = parse_ply_layout(_vertex_count.sub(b"element vertex", header))
+    return np.memmap(
+        file,
+        dtype=dtype,
+        mode="r",
+        offset=len(header),
+        shape=(int(count.group(1)),),
+    )
+
+
+def read_ply_scan(file, dtype=np.float32):
+    """Fast reader for the .ply scans written by bin2ply.py and ros2ply.py.
+    Returns the (N, 3) points, and the (N, 3) colors in [0, 1], where the
+    intensity is encoded, or None if not present. Both are float32 by
+    default, pass dtype=np.float64 to convert them in the same pass for
+    o3d.utility.Vector3dVector."""
+    vertices = read_ply_vertices(file)
+    names = vertices.dtype.names
+    points = structured_to_unstructured(vertices[["x", "y", "z"]], dtype=dtype)
+    colors = None
+    if all(name in names for name in ("red", "green", "blue")):
+        colors = structured_to_unstructured(
+            vertices[["red", "green", "blue"]], dtype=dtype
+        )
+        if vertices.dtype["red"].kind in "iu":
+            colors /= 255.0
+    return points, colors
@@ -0,0 +1,10 @@
+import os
+
+
+def file_key(path):
+    """Identify the current content of a file by its absolute path, last
+    modification time and size, without reading it."""
+    stat = os.stat(path)
+    return "{}:{}:{}".format(
+        os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+    )
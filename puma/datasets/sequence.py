@@ -0,0 +1,56 @@
+import glob
+import os
+
+import numpy as np
+import open3d as o3d
+
+from .kitti import BinSequence
+from .packed import PACKED_INDEX, PackedSequence
+from .ply import read_ply_scan
+from .scan_key import file_key
+
+
+class PlySequence:
+    """One .ply file per scan, the format produced by bin2ply.py.
+
+    Binary little endian scans are memory-mapped by read_ply_scan, any other
+    flavour of PLY is read through Open3D.
+    """
+
+    def __init__(self, scan_names):
+        self.scan_names = scan_names
+
+    def __len__(self):
+        return len(self.scan_names)
+
+    def scan_key(self, idx):
+        return file_key(self.scan_names[idx])
+
+    def __getitem__(self, idx):
+        try:
+            points, colors = read_ply_scan(self.scan_names[idx], np.float64)
+        except ValueError:
+            return o3d.io.read_point_cloud(self.scan_names[idx])
+        cloud = o3d.geometry.PointCloud()
+        cloud.points = o3d.utility.Vector3dVector(points)
+        if colors is not None:
+            cloud.colors = o3d.utility.Vector3dVector(colors)
+        return cloud
+
+
+def load_sequence(dataset, sequence):
+    """Return the scans of the given sequence of a KITTI-like dataset, as a
+    sequence of PointClouds. A packed copy of the sequence(see ply2pack.py)
+    is preferred over the individual scans if available. The format of the
+    individual scans, .ply or the original KITTI .bin, is picked from the
+    contents of the velodyne folder."""
+    sequence_dir = os.path.join(dataset, "sequences", sequence)
+    packed_dir = os.path.join(sequence_dir, "velodyne_packed")
+    if os.path.exists(os.path.join(packed_dir, PACKED_INDEX)):
+        return PackedSequence(packed_dir)
+
+    scans = os.path.join(sequence_dir, "velodyne", "")
+    ply_names = sorted(glob.glob(scans + "*.ply"))
+    if ply_names:
+        return PlySequence(ply_names)
+    return BinSequence(sorted(glob.glob(scans + "*.bin")))
@@ -1,2 +1,5 @@
+from .background import *
+from .chunked import *
 from .poisson import *
 from .size import *
+from .tiled import *
@@ -0,0 +1,137 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import open3d as o3d
+
+from ..utils import buffer_to_pointcloud
+from .poisson import run_poisson
+
+
+def mesh_to_arrays(mesh):
+    """Copy the vertices, triangles and vertex normals of the mesh to NumPy
+    arrays, e.g. to send them across processes."""
+    return (
+        np.asarray(mesh.vertices).copy(),
+        np.asarray(mesh.triangles).copy(),
+        np.asarray(mesh.vertex_normals).copy(),
+    )
+
+
+def mesh_from_arrays(vertices, triangles, normals):
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(vertices)
+    mesh.triangles = o3d.utility.Vector3iVector(triangles)
+    mesh.vertex_normals = o3d.utility.Vector3dVector(normals)
+    return mesh
+
+
+def _run_poisson_on_arrays(points, normals, depth, n_threads, min_density):
+    """run_poisson for a worker process, only NumPy arrays cross the process
+    boundary."""
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd.normals = o3d.utility.Vector3dVector(normals)
+    mesh, _ = run_poisson(pcd, depth, n_threads, min_density)
+    return mesh_to_arrays(mesh)
+
+
+class BackgroundMesher:
+    """Run the PSR of the local map in the background while the tracking
+    keeps registering scans against the previous mesh.
+
+    submit takes a snapshot of the local map and returns a ticket for it,
+    poll returns the (ticket, mesh) pairs finished since the last call in
+    submission order, so the caller swaps its mesh between 2 frames. At most
+    one PSR runs at a time. If several local maps are waiting meanwhile, only
+    the most recent one and the ones marked with retain, e.g. because the
+    global map needs them, are meshed. The mode is either "thread",
+    "process" or "sync", which runs the PSR inline on submit as before.
+    """
+
+    def __init__(self, depth, n_threads, min_density=None, mode="thread"):
+        self.depth = depth
+        self.n_threads = n_threads
+        self.min_density = min_density
+        self.mode = mode
+        if mode == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        elif mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=1)
+        elif mode == "sync":
+            self.executor = None
+        else:
+            raise ValueError("Unknown meshing mode " + str(mode))
+        self.n_submitted = 0
+        self._future = None
+        self._running = None
+        self._pending = deque()
+        self._retained = set()
+        self._ready = []
+
+    def submit(self, buffer):
+        # The buffer keeps changing while the PSR runs, take a copy now
+        pcd = buffer_to_pointcloud(buffer)
+        ticket = self.n_submitted
+        self.n_submitted += 1
+        if self.executor is None:
+            mesh, _ = run_poisson(
+                pcd, self.depth, self.n_threads, self.min_density
+            )
+            self._ready.append((ticket, mesh))
+            return ticket
+        self._pending.append((ticket, pcd))
+        self._launch()
+        return ticket
+
+    def retain(self, ticket):
+        """Make sure the given local map is meshed, even if a more recent one
+        is submitted before its turn."""
+        self._retained.add(ticket)
+
+    def _launch(self):
+        if self._future is not None or not self._pending:
+            return
+        # Skip the outdated local maps nobody needs
+        while (
+            len(self._pending) > 1 and self._pending[0][0] not in self._retained
+        ):
+            self._pending.popleft()
+        ticket, pcd = self._pending.popleft()
+        self._retained.discard(ticket)
+        self._running = ticket
+        if self.mode == "process":
+            self._future = self.executor.submit(
+                _run_poisson_on_arrays,
+                np.asarray(pcd.points),
+                np.asarray(pcd.normals),
+                self.depth,
+                self.n_threads,
+                self.min_density,
+            )
+        else:
+            self._future = self.executor.submit(
+                run_poisson, pcd, self.depth, self.n_threads, self.min_density
+            )
+
+    def _collect(self):
+        result = self._future.result()
+        ticket = self._running
+        self._future = None
+        self._launch()
+        if self.mode == "thread":
+            return ticket, result[0]
+        return ticket, mesh_from_arrays(*result)
+
+    def poll(self, wait=False):
+        """Return the (ticket, mesh) pairs finished since the last call, in
+        submission order. If wait, block until all the submitted local maps
+        are meshed."""
+        meshes, self._ready = self._ready, []
+        while self._future is not None and (wait or self._future.done()):
+            meshes.append(self._collect())
+        return meshes
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
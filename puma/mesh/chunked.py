@@ -0,0 +1,320 @@
+import os
+import shutil
+import tempfile
+from itertools import product
+from math import ceil, floor
+
+import numpy as np
+import open3d as o3d
+
+from .ply_writer import ply_face_bytes, ply_header, ply_vertex_bytes
+
+
+def weld_vertices(vertices, normals, triangles, return_index=False):
+    """Merge the vertices with exactly the same coordinates, like Open3D's
+    remove_duplicated_vertices, keeping the normal of the first one. If
+    return_index, also return the position of that first one."""
+    vertices, index, inverse = np.unique(
+        vertices, axis=0, return_index=True, return_inverse=True
+    )
+    triangles = inverse.reshape(-1)[triangles].astype(np.int32)
+    if return_index:
+        return vertices, normals[index], triangles, index
+    return vertices, normals[index], triangles
+
+
+def find_vertices(vertices, known):
+    """Index in known of each vertex with exactly the same coordinates, or -1
+    if there is none."""
+    _, first, inverse = np.unique(
+        np.vstack((known, vertices)),
+        axis=0,
+        return_index=True,
+        return_inverse=True,
+    )
+    first = first[inverse.reshape(-1)[len(known) :]]
+    return np.where(first < len(known), first, -1)
+
+
+def remove_duplicated_triangles(triangles):
+    """Remove the triangles using the same vertices with the same winding,
+    like Open3D's remove_duplicated_triangles."""
+    # Rotate each triangle to start from its smallest index
+    first = np.argmin(triangles, axis=1)
+    order = (first[:, None] + np.arange(3)) % 3
+    triangles = np.take_along_axis(triangles, order, axis=1)
+    _, index = np.unique(triangles, axis=0, return_index=True)
+    return triangles[np.sort(index)]
+
+
+class ChunkedMesh:
+    """Global mesh split in cubic chunks of chunk_size meters.
+
+    Each triangle belongs to the chunk of its centroid, and the chunk owns a
+    copy of the vertices it uses. New meshes are only welded into the chunks
+    they touch, so the cost of add depends on the size of the new mesh and
+    not on the size of the whole map. Vertices shared by triangles of
+    different chunks are only merged once, by to_mesh or write_ply, but
+    n_vertices already counts them once: each chunk keeps its border
+    vertices, and the ones a chunk gets that are already on the border of a
+    neighbor chunk are not counted again.
+
+    If a resident_radius is given, evict flushes the chunks further than
+    resident_radius from the sensor to a temporary directory inside
+    cache_dir(the system default if None), and they are loaded back only if
+    a new mesh touches them again. write_ply then streams the chunks one by
+    one, so the memory needed does not grow with the whole map. The
+    temporary directory is removed by close, or at the latest on exit.
+    """
+
+    def __init__(self, chunk_size=50.0, cache_dir=None, resident_radius=None):
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.resident_radius = resident_radius
+        self.chunks = {}
+        self.evicted = set()
+        self._spill_dir = None
+        # Vertices close enough to the faces of each resident chunk to be
+        # shared with a neighbor chunk
+        self._borders = {}
+        self.n_vertices = 0
+        self.n_triangles = 0
+        # Longest edge seen so far, bounds how far a shared vertex can be
+        # from the chunk of any triangle using it
+        self.max_edge = 0.0
+
+    def chunk_keys(self, vertices, triangles):
+        centroids = vertices[triangles].mean(axis=1)
+        return np.floor(centroids / self.chunk_size).astype(np.int64)
+
+    def add(self, mesh):
+        vertices = np.asarray(mesh.vertices)
+        normals = np.asarray(mesh.vertex_normals)
+        triangles = np.asarray(mesh.triangles)
+        if not len(triangles):
+            return
+        if not len(normals):
+            normals = np.zeros_like(vertices)
+        corners = vertices[triangles]
+        edges = corners - np.roll(corners, 1, axis=1)
+        self.max_edge = max(
+            self.max_edge, np.linalg.norm(edges, axis=2).max(initial=0.0)
+        )
+
+        # Group the triangles by chunk
+        keys, chunk_idx = np.unique(
+            self.chunk_keys(vertices, triangles),
+            axis=0,
+            return_inverse=True,
+        )
+        order = np.argsort(chunk_idx.reshape(-1), kind="stable")
+        splits = np.cumsum(np.bincount(chunk_idx.reshape(-1)))[:-1]
+        for key, chunk_triangles in zip(
+            map(tuple, keys), np.split(triangles[order], splits)
+        ):
+            used, local = np.unique(chunk_triangles, return_inverse=True)
+            self._weld(key, vertices[used], normals[used], local.reshape(-1, 3))
+
+    def _chunk_file(self, key):
+        return os.path.join(self._spill_dir.name, "{}_{}_{}.npz".format(*key))
+
+    def _load(self, key):
+        """Read back an evicted chunk, without making it resident."""
+        with np.load(self._chunk_file(key)) as data:
+            return (
+                data["vertices"],
+                data["normals"].astype(np.float64),
+                data["triangles"],
+            )
+
+    def _margin(self):
+        return self.max_edge + 1e-6
+
+    def _reach(self):
+        """How many chunks away a shared vertex can be, in each axis."""
+        return max(1, ceil(2 * self._margin() / self.chunk_size))
+
+    def _border_mask(self, key, vertices):
+        lower = np.asarray(key) * self.chunk_size
+        upper = lower + self.chunk_size
+        margin = self._margin()
+        return np.any(
+            (vertices < lower + margin) | (vertices > upper - margin), axis=1
+        )
+
+    def _neighbor_borders(self, key):
+        reach = self._reach()
+        borders = []
+        for offset in product(range(-reach, reach + 1), repeat=3):
+            neighbor = tuple(np.add(key, offset))
+            if neighbor == key:
+                continue
+            if neighbor in self._borders:
+                borders.append(self._borders[neighbor])
+            elif neighbor in self.evicted:
+                with np.load(self._chunk_file(neighbor)) as data:
+                    borders.append(data["border"])
+        return borders
+
+    def _weld(self, key, vertices, normals, triangles):
+        if key in self.evicted:
+            self.chunks[key] = self._load(key)
+            self.evicted.remove(key)
+        n_old = 0
+        if key in self.chunks:
+            old_vertices, old_normals, old_triangles = self.chunks[key]
+            n_old = len(old_vertices)
+            self.n_triangles -= len(old_triangles)
+            triangles = np.vstack((old_triangles, triangles + n_old))
+            vertices = np.vstack((old_vertices, vertices))
+            normals = np.vstack((old_normals, normals))
+        vertices, normals, triangles, first = weld_vertices(
+            vertices, normals, triangles, return_index=True
+        )
+        triangles = remove_duplicated_triangles(triangles)
+        self.chunks[key] = (vertices, normals, triangles)
+        self.n_triangles += len(triangles)
+
+        # Only the new vertices on the border might be already counted
+        border = self._border_mask(key, vertices)
+        new = first >= n_old
+        neighbor_borders = self._neighbor_borders(key)
+        shared = 0
+        if neighbor_borders:
+            shared = np.count_nonzero(
+                find_vertices(
+                    vertices[new & border], np.vstack(neighbor_borders)
+                )
+                >= 0
+            )
+        self.n_vertices += np.count_nonzero(new) - shared
+        self._borders[key] = vertices[border]
+
+    def evict(self, center):
+        """Flush to disk all the chunks further than resident_radius from the
+        given center, usually the current position of the sensor."""
+        if self.resident_radius is None:
+            return
+        if self._spill_dir is None:
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            self._spill_dir = tempfile.TemporaryDirectory(
+                prefix="chunks_", dir=self.cache_dir
+            )
+        for key in list(self.chunks):
+            chunk_center = (np.asarray(key) + 0.5) * self.chunk_size
+            if np.linalg.norm(chunk_center - center) > self.resident_radius:
+                vertices, normals, triangles = self.chunks.pop(key)
+                # Vertices stay in double precision, welding is exact
+                np.savez(
+                    self._chunk_file(key),
+                    vertices=vertices,
+                    normals=normals.astype(np.float32),
+                    triangles=triangles,
+                    border=self._borders.pop(key),
+                )
+                self.evicted.add(key)
+
+    def close(self):
+        """Remove the evicted chunks from disk, they are lost afterwards."""
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+        self.evicted.clear()
+
+    def iter_chunks(self):
+        """Yield (key, vertices, normals, triangles) of all the chunks, both
+        resident and evicted, in a deterministic order."""
+        for key in sorted(set(self.chunks) | self.evicted):
+            if key in self.chunks:
+                yield (key,) + self.chunks[key]
+            else:
+                yield (key,) + self._load(key)
+
+    def get_size_mb(self):
+        """Same as get_mesh_size_mb, without assembling the whole mesh."""
+        size = -1 + 3 * (8 * self.n_vertices + 4 * self.n_triangles)
+        return floor(size / 1024.0 / 1024.0)
+
+    def to_mesh(self):
+        """Assemble all the chunks, also the evicted ones, in a single
+        o3d.geometry.TriangleMesh."""
+        vertices, normals, triangles = [], [], []
+        n_vertices = 0
+        for (
+            _,
+            chunk_vertices,
+            chunk_normals,
+            chunk_triangles,
+        ) in self.iter_chunks():
+            vertices.append(chunk_vertices)
+            normals.append(chunk_normals)
+            triangles.append(chunk_triangles + n_vertices)
+            n_vertices += len(chunk_vertices)
+
+        mesh = o3d.geometry.TriangleMesh()
+        if not vertices:
+            return mesh
+        vertices, normals, triangles = weld_vertices(
+            np.vstack(vertices), np.vstack(normals), np.vstack(triangles)
+        )
+        mesh.vertices = o3d.utility.Vector3dVector(vertices)
+        mesh.vertex_normals = o3d.utility.Vector3dVector(normals)
+        mesh.triangles = o3d.utility.Vector3iVector(triangles)
+        return mesh
+
+    def write_ply(self, filename):
+        """Write the whole mesh to a binary PLY file, one chunk at a time.
+
+        Only the vertices close enough to the border of their chunk to be
+        shared with another chunk are kept in memory to weld them, and only
+        while a chunk still to be written can touch them. The vertices and
+        faces are first written to temporary files, since their final count
+        is only known at the end.
+        """
+        # Border vertices and their index in the PLY file, for each chunk
+        shared = {}
+        n_vertices = 0
+        n_triangles = 0
+        reach = self._reach()
+        vertices_file = filename + ".vertices.tmp"
+        faces_file = filename + ".faces.tmp"
+        with open(vertices_file, "wb") as vertex_out, open(
+            faces_file, "wb"
+        ) as face_out:
+            for key, vertices, normals, triangles in self.iter_chunks():
+                # Chunks are sorted by key, the ones too far behind in x can
+                # not be neighbors of this chunk or of the next ones
+                for old_key in [k for k in shared if k[0] < key[0] - reach]:
+                    del shared[old_key]
+
+                border = self._border_mask(key, vertices)
+                index = np.full(len(vertices), -1, dtype=np.int64)
+                neighbors = [
+                    shared[k]
+                    for k in shared
+                    if np.all(np.abs(np.subtract(k, key)) <= reach)
+                ]
+                if neighbors:
+                    # Reuse the PLY index of the vertices already written
+                    known = np.vstack([n[0] for n in neighbors])
+                    known_index = np.concatenate([n[1] for n in neighbors])
+                    found = find_vertices(vertices[border], known)
+                    index[border] = np.where(found >= 0, known_index[found], -1)
+
+                new = index < 0
+                index[new] = n_vertices + np.arange(np.count_nonzero(new))
+                shared[key] = (vertices[border], index[border])
+                n_vertices += np.count_nonzero(new)
+                n_triangles += len(triangles)
+
+                vertex_out.write(ply_vertex_bytes(vertices[new], normals[new]))
+                face_out.write(ply_face_bytes(index[triangles]))
+
+        with open(filename, "wb") as ply_file:
+            ply_file.write(ply_header(n_vertices, n_triangles))
+            for tmp_file in (vertices_file, faces_file):
+                with open(tmp_file, "rb") as tmp:
+                    shutil.copyfileobj(tmp, ply_file)
+                os.remove(tmp_file)
+        return n_vertices, n_triangles
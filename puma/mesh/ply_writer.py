@@ -0,0 +1,48 @@
+import numpy as np
+
+PLY_VERTEX_DTYPE = np.dtype(
+    [
+        ("x", "<f8"),
+        ("y", "<f8"),
+        ("z", "<f8"),
+        ("nx", "<f8"),
+        ("ny", "<f8"),
+        ("nz", "<f8"),
+    ]
+)
+PLY_FACE_DTYPE = np.dtype([("n", "u1"), ("vertex_indices", "<i4", (3,))])
+
+
+def ply_header(n_vertices, n_triangles):
+    """Binary little endian PLY header, same layout written by Open3D for a
+    TriangleMesh with vertex normals."""
+    lines = [
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment Created by puma",
+        "element vertex {}".format(n_vertices),
+        "property double x",
+        "property double y",
+        "property double z",
+        "property double nx",
+        "property double ny",
+        "property double nz",
+        "element face {}".format(n_triangles),
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def ply_vertex_bytes(vertices, normals):
+    data = np.empty(len(vertices), dtype=PLY_VERTEX_DTYPE)
+    data["x"], data["y"], data["z"] = vertices.T
+    data["nx"], data["ny"], data["nz"] = normals.T
+    return data.tobytes()
+
+
+def ply_face_bytes(triangles):
+    data = np.empty(len(triangles), dtype=PLY_FACE_DTYPE)
+    data["n"] = 3
+    data["vertex_indices"] = triangles
+    return data.tobytes()
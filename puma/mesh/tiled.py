@@ -0,0 +1,127 @@
+import os
+from math import ceil, log2
+
+import numpy as np
+import open3d as o3d
+
+from ..utils import prefetch
+from .poisson import run_poisson
+
+
+def plan_tiles(points, tile_size, overlap):
+    """Split the points in square tiles of tile_size meters on the xy plane,
+    each one extended by overlap meters on every side. Returns the key of
+    each tile with at least one point in its core and the indices of all the
+    points in its extended region."""
+    if not 2 * overlap < tile_size:
+        raise ValueError("The overlap must be below tile_size / 2")
+    xy = points[:, :2]
+    lower = np.floor((xy - overlap) / tile_size).astype(np.int64)
+    upper = np.floor((xy + overlap) / tile_size).astype(np.int64)
+
+    # Each point falls in the extended region of at most 2x2 tiles
+    indices, keys = [], []
+    for offset in ((0, 0), (0, 1), (1, 0), (1, 1)):
+        key = lower + offset
+        inside = np.all(key <= upper, axis=1)
+        indices.append(np.flatnonzero(inside))
+        keys.append(key[inside])
+    indices = np.concatenate(indices)
+    keys, tile_idx = np.unique(np.vstack(keys), axis=0, return_inverse=True)
+    tile_idx = tile_idx.reshape(-1)
+    order = np.argsort(tile_idx, kind="stable")
+    splits = np.cumsum(np.bincount(tile_idx, minlength=len(keys)))[:-1]
+
+    core_keys = np.unique(np.floor(xy / tile_size).astype(np.int64), axis=0)
+    core_keys = set(map(tuple, core_keys.tolist()))
+    return [
+        (key, tile_points)
+        for key, tile_points in zip(
+            map(tuple, keys.tolist()), np.split(indices[order], splits)
+        )
+        if key in core_keys
+    ]
+
+
+def mesh_tile(job):
+    """PSR over the points of one extended tile, keeping only the triangles
+    with their centroid in the core of the tile."""
+    points, normals, core, depth, n_threads, min_density = job
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
+    pcd.normals = o3d.utility.Vector3dVector(normals)
+    mesh, _ = run_poisson(pcd, depth, n_threads, min_density)
+
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    centroids = vertices[triangles].mean(axis=1)[:, :2]
+    in_core = np.all((centroids >= core[0]) & (centroids < core[1]), axis=1)
+    triangles = triangles[in_core]
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return (
+        vertices[used],
+        np.asarray(mesh.vertex_normals)[used],
+        triangles.reshape(-1, 3),
+    )
+
+
+def tile_depth(depth, extent, tile_extent):
+    """Octree depth giving the tiles the same resolution the whole map would
+    get with the given depth."""
+    return min(depth, max(1, ceil(depth - log2(extent / tile_extent))))
+
+
+def run_tiled_poisson(
+    pcd,
+    depth,
+    tile_size=100.0,
+    overlap=10.0,
+    min_density=None,
+    n_workers=None,
+):
+    """Same as run_poisson, but split the map in overlapping tiles that are
+    meshed independently on a pool of n_workers processes. Each tile only
+    keeps the triangles of its core, the overlap gives PSR enough context at
+    the borders. The memory needed per worker depends on the tile_size, not
+    on the size of the whole map.
+
+    Tiles are not welded, the crops of 2 neighbouring tiles meet but do not
+    share vertices.
+    """
+    n_workers = n_workers or os.cpu_count()
+    n_threads = max(1, os.cpu_count() // n_workers)
+    points = np.asarray(pcd.points)
+    normals = np.asarray(pcd.normals)
+    extent = np.max(pcd.get_max_bound() - pcd.get_min_bound())
+    depth = tile_depth(depth, extent, tile_size + 2 * overlap)
+
+    def jobs():
+        for key, indices in plan_tiles(points, tile_size, overlap):
+            core = np.array([key, np.add(key, 1)], dtype=np.float64)
+            yield (
+                points[indices],
+                normals[indices],
+                core * tile_size,
+                depth,
+                n_threads,
+                min_density,
+            )
+
+    vertices, vertex_normals, triangles = [], [], []
+    n_vertices = 0
+    for tile_vertices, tile_normals, tile_triangles in prefetch(
+        mesh_tile, jobs(), n_workers, n_workers, processes=True
+    ):
+        vertices.append(tile_vertices)
+        vertex_normals.append(tile_normals)
+        triangles.append(tile_triangles + n_vertices)
+        n_vertices += len(tile_vertices)
+
+    mesh = o3d.geometry.TriangleMesh()
+    if vertices:
+        mesh.vertices = o3d.utility.Vector3dVector(np.vstack(vertices))
+        mesh.vertex_normals = o3d.utility.Vector3dVector(
+            np.vstack(vertex_normals)
+        )
+        mesh.triangles = o3d.utility.Vector3iVector(np.vstack(triangles))
+    return mesh
@@ -1 +1,2 @@
+from .cache import *
 from .preprocess_cloud import *
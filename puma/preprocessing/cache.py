@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import open3d as o3d
+
+# Every config field that changes the output of preprocess
+PREPROCESS_FIELDS = (
+    "voxel_size",
+    "max_nn",
+    "normals",
+    "downsample",
+    "W",
+    "H",
+    "fov_up",
+    "fov_down",
+    "max_range",
+)
+
+
+class ScanCache:
+    """On-disk cache of preprocessed scans, one float32 .npy file per scan
+    with the points and, if any, the normals.
+
+    Each entry is keyed by the scan it comes from(path + mtime, see the
+    scan_key of the sequences in puma.datasets) and the preprocessing fields
+    of the config, so changing any other parameter(ICP, PSR, ...) reuses the
+    cached scans. Once the cache grows over max_size bytes the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_size=10 * 1024**3):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".npy")
+        ]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    @staticmethod
+    def key(scan_key, config):
+        fields = {field: config.get(field) for field in PREPROCESS_FIELDS}
+        fields["scan"] = scan_key
+        content = json.dumps(fields, sort_keys=True).encode()
+        return hashlib.sha1(content).hexdigest()
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            data = np.load(path)
+            # Refresh the entry for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        cloud = o3d.geometry.PointCloud()
+        cloud.points = o3d.utility.Vector3dVector(data[:, :3])
+        if data.shape[1] == 6:
+            cloud.normals = o3d.utility.Vector3dVector(data[:, 3:])
+        return cloud
+
+    def store(self, key, cloud):
+        rows = [np.asarray(cloud.points)]
+        if cloud.has_normals():
+            rows.append(np.asarray(cloud.normals))
+        data = np.hstack(rows).astype(np.float32)
+
+        # Write + rename, concurrent readers never see a partial entry. The
+        # temporary file is unique across threads and worker processes
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.save(tmp_file, data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += os.path.getsize(path)
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is below
+        90% of its maximum size."""
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_scan_cache(config):
+    """Return the ScanCache configured by cache_dir and cache_size[GB], or
+    None if the cache is disabled."""
+    cache_dir = config.get("cache_dir")
+    if not cache_dir:
+        return None
+    with _caches_lock:
+        if cache_dir not in _caches:
+            max_size = config.get("cache_size", 10.0) * 1024**3
+            _caches[cache_dir] = ScanCache(cache_dir, max_size)
+        return _caches[cache_dir]
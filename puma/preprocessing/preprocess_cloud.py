@@ -3,6 +3,9 @@ from copy import deepcopy
 
 import open3d as o3d
 
+from ..utils import prefetch
+from .cache import get_scan_cache
+from .range_image_normal import BatchNormalEstimator
 from .range_image_normal import compute_normals as ri_normal
 
 
@@ -14,6 +17,9 @@ def preprocess_cloud(
     downsample=False,
     W=1024,
     H=64,
+    fov_up=3.0,
+    fov_down=-25.0,
+    max_range=50.0,
 ):
     if downsample:
         cloud = pcd.voxel_down_sample(voxel_size)
@@ -22,7 +28,7 @@ def preprocess_cloud(
 
     if normals:
         if normals == "range_image":
-            ri_normal(cloud, W, H)
+            ri_normal(cloud, W, H, fov_up, fov_down, max_range)
         else:
             params = o3d.geometry.KDTreeSearchParamKNN(max_nn)
             cloud.estimate_normals(params)
@@ -40,4 +46,50 @@ def preprocess(pcd, config):
         config.downsample,
         config.W,
         config.H,
+        config.get("fov_up", 3.0),
+        config.get("fov_down", -25.0),
+        config.get("max_range", 50.0),
     )
+
+
+def preprocess_scan(scans, idx, config):
+    """preprocess the idx-th scan of the sequence, reusing the result of a
+    previous run from the on-disk cache if enabled, see ScanCache."""
+    cache = get_scan_cache(config)
+    if cache is None:
+        return preprocess(scans[idx], config)
+
+    key = cache.key(scans.scan_key(idx), config)
+    cloud = cache.load(key)
+    if cloud is None:
+        cloud = preprocess(scans[idx], config)
+        cache.store(key, cloud)
+    return cloud
+
+
+def prefetch_scans(scans, indices, config):
+    """Read and preprocess the scans at the given indices in background
+    threads, in order, while the caller is busy with the current one."""
+    return prefetch(
+        lambda idx: preprocess_scan(scans, idx, config),
+        indices,
+        config.get("prefetch_workers", 2),
+        config.get("prefetch", 4),
+    )
+
+
+def preprocess_batches(scans, indices, normals=None, batch_size=32):
+    """Yield (idx, cloud) for each of the scans at the given indices, same as
+    preprocess_cloud with the default parameters. Range image normals are
+    computed for batch_size scans at once, see BatchNormalEstimator."""
+    if normals != "range_image":
+        for idx in indices:
+            yield idx, preprocess_cloud(scans[idx], normals=normals)
+        return
+
+    estimator = BatchNormalEstimator(batch_size)
+    indices = list(indices)
+    for first in range(0, len(indices), batch_size):
+        batch = indices[first : first + batch_size]
+        clouds = estimator.compute([scans[idx] for idx in batch])
+        yield from zip(batch, clouds)
@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
 import click
+import numpy as np
 import open3d as o3d
 
-from ..cpp.normal_map import gen_normal_map
-from ..projections.range_image import project_to_range_image
+from ..cpp.normal_map import (
+    gen_normal_map,
+    gen_normal_maps,
+    gen_normals_from_points,
+)
+from ..projections.range_image import RangeImageProjector, get_projector
 
 
-def compute_normals(cloud, w, h):
-    range_image, vertex_map = project_to_range_image(cloud, w, h)
+def compute_normals(cloud, w, h, fov_up=3.0, fov_down=-25.0, max_range=50.0):
+    """Replace the points of the cloud with the ones kept in the (h, w) range
+    image, and estimate their normals from their neighbouring pixels. Runs in
+    a single pass of the C++ extension."""
+    points, normals = gen_normals_from_points(
+        np.asarray(cloud.points), w, h, fov_up, fov_down, max_range
+    )
+    cloud.points = o3d.utility.Vector3dVector(points)
+    cloud.normals = o3d.utility.Vector3dVector(normals)
+    return cloud
+
+
+def compute_normals_reference(
+    cloud, w, h, fov_up=3.0, fov_down=-25.0, max_range=50.0
+):
+    """Step by step version of compute_normals, on top of the range image."""
+    projector = get_projector(w, h, fov_up, fov_down, max_range)
+    range_image, vertex_map = projector.project(np.asarray(cloud.points))
     normal_map = gen_normal_map(range_image, vertex_map, w, h)
     cloud.points = o3d.utility.Vector3dVector(vertex_map.reshape(h * w, 3))
     cloud.normals = o3d.utility.Vector3dVector(normal_map.reshape(h * w, 3))
@@ -15,6 +36,57 @@ def compute_normals(cloud, w, h):
     return cloud
 
 
+class BatchNormalEstimator:
+    """Range image normals for batches of up to batch_size scans at once.
+    The range images, vertex and normal maps of the whole batch are allocated
+    once and the C++ extension runs over all the scans of the batch in
+    parallel, see gen_normal_maps."""
+
+    def __init__(
+        self,
+        batch_size=32,
+        w=1024,
+        h=64,
+        fov_up=3.0,
+        fov_down=-25.0,
+        max_range=50.0,
+    ):
+        self.batch_size = batch_size
+        self.projector = RangeImageProjector(w, h, fov_up, fov_down, max_range)
+        self.range_images = np.empty((batch_size, h, w), dtype=np.float32)
+        self.vertex_maps = np.empty((batch_size, h, w, 3), dtype=np.float32)
+        self.normal_maps = np.empty((batch_size, h, w, 3), dtype=np.float32)
+
+    def compute(self, clouds):
+        """Return a new PointCloud with normals for each of the given clouds,
+        same as compute_normals."""
+        n_clouds = len(clouds)
+        assert n_clouds <= self.batch_size, "Batch too large"
+        for i, cloud in enumerate(clouds):
+            range_image, vertex_map = self.projector.project(
+                np.asarray(cloud.points)
+            )
+            self.range_images[i] = range_image
+            self.vertex_maps[i] = vertex_map
+        gen_normal_maps(
+            self.range_images[:n_clouds],
+            self.vertex_maps[:n_clouds],
+            self.normal_maps[:n_clouds],
+        )
+
+        results = []
+        for i in range(n_clouds):
+            points = self.vertex_maps[i].reshape(-1, 3)
+            valid = np.isfinite(points[:, 0])
+            cloud = o3d.geometry.PointCloud()
+            cloud.points = o3d.utility.Vector3dVector(points[valid])
+            cloud.normals = o3d.utility.Vector3dVector(
+                self.normal_maps[i].reshape(-1, 3)[valid]
+            )
+            results.append(cloud)
+        return results
+
+
 @click.command()
 @click.argument("file", type=click.Path(exists=True))
 @click.option("-w", default=1024, type=int)
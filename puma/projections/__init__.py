@@ -1,2 +1,5 @@
+from .intersector import *
+from .mesh_range_image import *
 from .range_image import *
+from .raycasting import *
 from .scan2mesh import *
@@ -0,0 +1,71 @@
+import numpy as np
+
+from ..utils import MeshCache
+from .raycasting import get_raycaster
+
+_intersectors = MeshCache()
+
+
+def crop_mesh(vertices, triangles, min_bound, max_bound):
+    """Keep only the triangles with at least one vertex inside the given
+    axis aligned box, and the vertices they use."""
+    inside = np.all((vertices >= min_bound) & (vertices <= max_bound), axis=1)
+    triangles = triangles[inside[triangles].any(axis=1)]
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return vertices[used], triangles.reshape(-1, 3)
+
+
+def build_intersector(mesh, raycaster="embree", crop_box=None):
+    """Build the ray-casting backend for the given Open3D mesh, which owns the
+    acceleration structure(BVH) and the face normals of the mesh. If a
+    (min_bound, max_bound) crop_box is given, only that region is used."""
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    if crop_box is not None:
+        vertices, triangles = crop_mesh(vertices, triangles, *crop_box)
+    return get_raycaster(raycaster, vertices, triangles)
+
+
+def get_intersector(
+    mesh,
+    version=None,
+    raycaster="embree",
+    center=None,
+    radius=None,
+    bucket_size=10.0,
+    max_size=4,
+):
+    """Return the intersector of the given mesh, building it only once for
+    each (mesh, version, raycaster) tuple.
+
+    The caller is responsible of bumping the version every time the geometry
+    of the mesh changes(new PSR output, in-place transformations, etc). If no
+    version is given the intersector is built from scratch and not cached.
+
+    If a center and a radius are given, the mesh is cropped to the region
+    reachable by rays of that length before building the intersector. The
+    center is snapped to a grid of bucket_size, so the same cropped
+    intersector is reused while the sensor stays in the same bucket.
+    """
+    crop_box, bucket = None, None
+    if center is not None and radius is not None:
+        bucket = tuple(np.floor(np.asarray(center) / bucket_size).astype(int))
+        radius = bucket_size * np.ceil(radius / bucket_size)
+        bucket_center = (np.asarray(bucket) + 0.5) * bucket_size
+        extent = radius + bucket_size
+        crop_box = (bucket_center - extent, bucket_center + extent)
+        bucket = bucket + (radius,)
+
+    if version is None:
+        return build_intersector(mesh, raycaster, crop_box)
+
+    return _intersectors.get(
+        mesh,
+        (version, raycaster, bucket),
+        lambda: build_intersector(mesh, raycaster, crop_box),
+        max_size,
+    )
+
+
+def clear_intersectors():
+    _intersectors.clear()
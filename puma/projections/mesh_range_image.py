@@ -0,0 +1,192 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+def spherical_coords(points, W=1024, H=64, fov_up=3.0, fov_down=-25.0):
+    """Return the continuous (u, v) image coordinates and the depth of each
+    point, using the same spherical model as project_to_range_image."""
+    fov_up = fov_up / 180.0 * np.pi
+    fov_down = fov_down / 180.0 * np.pi
+    fov = abs(fov_down) + abs(fov_up)
+
+    depth = np.linalg.norm(points, axis=1)
+    yaw = -np.arctan2(points[:, 1], points[:, 0])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pitch = np.arcsin(np.clip(points[:, 2] / depth, -1.0, 1.0))
+
+    u = 0.5 * (yaw / np.pi + 1.0) * W
+    v = (1.0 - (pitch + abs(fov_down)) / fov) * H
+    return u, v, depth
+
+
+@lru_cache(maxsize=4)
+def pixel_directions(W=1024, H=64, fov_up=3.0, fov_down=-25.0):
+    """Unit ray directions, in the sensor frame, through each pixel center."""
+    fov_up = fov_up / 180.0 * np.pi
+    fov_down = fov_down / 180.0 * np.pi
+    fov = abs(fov_down) + abs(fov_up)
+
+    yaw = (2.0 * (np.arange(W) + 0.5) / W - 1.0) * np.pi
+    pitch = (1.0 - (np.arange(H) + 0.5) / H) * fov - abs(fov_down)
+    pitch, yaw = np.meshgrid(pitch, yaw, indexing="ij")
+    directions = np.stack(
+        (
+            np.cos(pitch) * np.cos(-yaw),
+            np.cos(pitch) * np.sin(-yaw),
+            np.sin(pitch),
+        ),
+        axis=-1,
+    )
+    directions.setflags(write=False)
+    return directions
+
+
+def triangle_footprints(
+    u,
+    v,
+    triangles,
+    W,
+    H,
+    valid=None,
+    max_footprint=None,
+    conservative=False,
+):
+    """Enumerate the (triangle, x, y) pairs of all the pixel centers that
+    might be covered by each triangle in a (H, W) spherical image, given the
+    continuous image coordinates (u, v) of the vertices. If conservative,
+    all the pixels touched by the triangle are returned instead."""
+    tri_u = u[triangles]
+    tri_v = v[triangles]
+
+    # Triangles crossing the yaw seam are unwrapped to the right of the image
+    seam = (tri_u.max(axis=1) - tri_u.min(axis=1)) > W / 2
+    tri_u[seam] = np.where(tri_u[seam] < W / 2, tri_u[seam] + W, tri_u[seam])
+
+    # The edges are not straight lines in the spherical image, therefore the
+    # bounding box is slightly enlarged
+    margin = 0.25
+    if conservative:
+        x0 = np.floor(tri_u.min(axis=1) - margin).astype(np.int64)
+        x1 = np.floor(tri_u.max(axis=1) + margin).astype(np.int64)
+        y0 = np.floor(tri_v.min(axis=1) - margin)
+        y1 = np.floor(tri_v.max(axis=1) + margin)
+    else:
+        x0 = np.ceil(tri_u.min(axis=1) - 0.5 - margin).astype(np.int64)
+        x1 = np.floor(tri_u.max(axis=1) - 0.5 + margin).astype(np.int64)
+        y0 = np.ceil(tri_v.min(axis=1) - 0.5 - margin)
+        y1 = np.floor(tri_v.max(axis=1) - 0.5 + margin)
+    y0 = np.maximum(y0, 0).astype(np.int64)
+    y1 = np.minimum(y1, H - 1).astype(np.int64)
+    nx = x1 - x0 + 1
+    ny = y1 - y0 + 1
+
+    keep = (nx > 0) & (ny > 0)
+    if valid is not None:
+        keep &= valid
+    if max_footprint is not None:
+        keep &= (nx <= max_footprint) & (ny <= max_footprint)
+    tri_idx = np.flatnonzero(keep)
+    counts = nx[tri_idx] * ny[tri_idx]
+
+    tri = np.repeat(tri_idx, counts)
+    local = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    px = (x0[tri] + local % nx[tri]) % W
+    py = y0[tri] + local // nx[tri]
+    return tri, px, py
+
+
+def ray_triangle_intersection(origins, directions, vertices, triangles):
+    """Vectorized Moller-Trumbore intersection between each ray and its
+    triangle. Returns the hit mask and the ray parameter t of each pair."""
+    # The small tolerance avoids holes along the edges shared by 2 triangles
+    eps = 1e-9
+    a = vertices[triangles[:, 0]] - origins
+    e1 = vertices[triangles[:, 1]] - vertices[triangles[:, 0]]
+    e2 = vertices[triangles[:, 2]] - vertices[triangles[:, 0]]
+    pvec = np.cross(directions, e2)
+    det = np.einsum("ij,ij->i", e1, pvec)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        inv_det = 1.0 / det
+        bary_u = -np.einsum("ij,ij->i", a, pvec) * inv_det
+        qvec = np.cross(-a, e1)
+        bary_v = np.einsum("ij,ij->i", directions, qvec) * inv_det
+        t = np.einsum("ij,ij->i", e2, qvec) * inv_det
+    hit = (
+        (np.abs(det) > 1e-12)
+        & (bary_u >= -eps)
+        & (bary_v >= -eps)
+        & (bary_u + bary_v <= 1.0 + eps)
+        & (t > 0.0)
+    )
+    return hit, t
+
+
+def render_mesh_to_range_image(
+    vertices,
+    triangles,
+    sensor_pose=np.eye(4),
+    W=1024,
+    H=64,
+    fov_up=3.0,
+    fov_down=-25.0,
+    max_range=np.inf,
+    max_footprint=64,
+):
+    """Rasterize a triangle mesh into a (H, W) spherical range image as seen
+    from the sensor_pose.
+
+    Each triangle is only tested against the pixels of its footprint in the
+    image, so the cost is linear in the number of triangles plus the number
+    of covered pixels. Returns the range image, and the vertex and normal maps
+    of the hit surface expressed in the frame of the mesh. Triangles covering
+    more than max_footprint pixels along any axis(i.e., right next to the
+    sensor) are skipped.
+    """
+    # Move the mesh to the sensor frame, the rays start at the origin
+    rotation = sensor_pose[:3, :3]
+    origin = sensor_pose[:3, 3]
+    points = (vertices - origin) @ rotation
+    u, v, depth = spherical_coords(points, W, H, fov_up, fov_down)
+
+    valid = (depth[triangles].min(axis=1) > 0) & (
+        depth[triangles].min(axis=1) < max_range
+    )
+    tri, px, py = triangle_footprints(
+        u, v, triangles, W, H, valid, max_footprint
+    )
+    directions = pixel_directions(W, H, fov_up, fov_down)[py, px]
+    hit, t = ray_triangle_intersection(
+        np.zeros(3), directions, points, triangles[tri]
+    )
+    hit &= t < max_range
+    tri, pixel, t = tri[hit], (py * W + px)[hit], t[hit]
+    directions = directions[hit]
+
+    # z-buffer: keep the closest hit for each pixel
+    proj_range = np.full(H * W, np.inf)
+    proj_vertex = np.full((H * W, 3), np.nan)
+    proj_normal = np.full((H * W, 3), np.nan)
+    np.minimum.at(proj_range, pixel, t)
+    closest = t == proj_range[pixel]
+    tri, pixel, t = tri[closest], pixel[closest], t[closest]
+    directions = directions[closest]
+
+    # Express the hits and their face normals back in the mesh frame
+    proj_vertex[pixel] = (t[:, None] * directions) @ rotation.T + origin
+    hit_triangles = triangles[tri]
+    normals = np.cross(
+        vertices[hit_triangles[:, 1]] - vertices[hit_triangles[:, 0]],
+        vertices[hit_triangles[:, 2]] - vertices[hit_triangles[:, 0]],
+    )
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    proj_normal[pixel] = normals
+
+    proj_range[np.isinf(proj_range)] = np.nan
+    return (
+        proj_range.reshape(H, W),
+        proj_vertex.reshape(H, W, 3),
+        proj_normal.reshape(H, W, 3),
+    )
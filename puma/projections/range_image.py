@@ -1,72 +1,85 @@
 #!/usr/bin/env python3
+import threading
 
 import click
 import matplotlib.pyplot as plt
 import numpy as np
 import open3d as o3d
 
+from .mesh_range_image import spherical_coords
 
-def project_to_range_image(cloud, W=1024, H=64, max_range=50):
-    """Project a pointcloud into a spherical projection image.projection.
-    Function takes no arguments because it can be also called externally if the
-    value of the constructor was not set (in case you change your mind about
-    wanting the projection)
-    """
-    current_vertex = np.asarray(cloud.points)
-
-    # laser parameters, TODO: make this configurable
-    fov_up = 3.0 / 180.0 * np.pi  # field of view up in radians
-    fov_down = -25.0 / 180.0 * np.pi  # field of view down in radians
-    fov = abs(fov_down) + abs(fov_up)  # get field of view total in radians
-
-    # get depth of all points
-    depth = np.linalg.norm(current_vertex, axis=1)
-    current_vertex = current_vertex[(depth > 0) & (depth < max_range)]
-    depth = depth[(depth > 0) & (depth < max_range)]
-
-    # get scan components
-    scan_x = current_vertex[:, 0]
-    scan_y = current_vertex[:, 1]
-    scan_z = current_vertex[:, 2]
-
-    # get angles of all points
-    yaw = -np.arctan2(scan_y, scan_x)
-    pitch = np.arcsin(scan_z / depth)
-
-    # get projections in image coords
-    proj_x = 0.5 * (yaw / np.pi + 1.0)  # in [0.0, 1.0]
-    proj_y = 1.0 - (pitch + abs(fov_down)) / fov  # in [0.0, 1.0]
 
-    # scale to image size using angular resolution
-    proj_x *= W  # in [0.0, W]
-    proj_y *= H  # in [0.0, H]
+class RangeImageProjector:
+    """Spherical projection of pointclouds into (H, W) range images, for a
+    given sensor model. The default values match the Velodyne HDL-64 of KITTI.
 
-    # round and clamp for use as index
-    proj_x = np.floor(proj_x)
-    proj_x = np.minimum(W - 1, proj_x)
-    proj_x = np.maximum(0, proj_x).astype(np.int32)
-
-    proj_y = np.floor(proj_y)
-    proj_y = np.minimum(H - 1, proj_y)
-    proj_y = np.maximum(0, proj_y).astype(np.int32)
-
-    # order in decreasing depth
-    order = np.argsort(depth)[::-1]
-    depth = depth[order]
-    proj_y = proj_y[order]
-    proj_x = proj_x[order]
-
-    scan_x = scan_x[order]
-    scan_y = scan_y[order]
-    scan_z = scan_z[order]
-
-    proj_range = np.full((H, W), np.nan, dtype=np.float32)
-    proj_vertex = np.full((H, W, 3), np.nan, dtype=np.float32)
-
-    proj_range[proj_y, proj_x] = depth
-    proj_vertex[proj_y, proj_x] = np.array([scan_x, scan_y, scan_z]).T
+    The output buffers are allocated once and reused on every call, so the
+    returned images are only valid until the next call to project. Use
+    get_projector to get one projector per thread.
+    """
 
-    return proj_range, proj_vertex
+    def __init__(
+        self, W=1024, H=64, fov_up=3.0, fov_down=-25.0, max_range=50.0
+    ):
+        self.W = W
+        self.H = H
+        self.fov_up = fov_up
+        self.fov_down = fov_down
+        self.max_range = max_range
+        self.proj_range = np.empty((H, W), dtype=np.float32)
+        self.proj_vertex = np.empty((H, W, 3), dtype=np.float32)
+        self._zbuffer = np.empty(H * W, dtype=np.float32)
+
+    def project(self, points):
+        """Project the (N, 3) points, keeping the closest point of each pixel.
+        Returns the range image and the vertex map, NaN where empty."""
+        W, H = self.W, self.H
+        u, v, depth = spherical_coords(points, W, H, self.fov_up, self.fov_down)
+        valid = (depth > 0) & (depth < self.max_range)
+        points, u, v = points[valid], u[valid], v[valid]
+        depth = depth[valid].astype(np.float32)
+
+        # round and clamp for use as index
+        proj_x = np.clip(np.floor(u), 0, W - 1).astype(np.int64)
+        proj_y = np.clip(np.floor(v), 0, H - 1).astype(np.int64)
+        pixel = proj_y * W + proj_x
+
+        # z-buffer: resolve the collisions with a scatter-min, in linear time
+        self._zbuffer.fill(np.inf)
+        np.minimum.at(self._zbuffer, pixel, depth)
+        closest = depth == self._zbuffer[pixel]
+        pixel = pixel[closest]
+
+        self.proj_range.fill(np.nan)
+        self.proj_vertex.fill(np.nan)
+        self.proj_range.reshape(-1)[pixel] = depth[closest]
+        self.proj_vertex.reshape(-1, 3)[pixel] = points[closest]
+        return self.proj_range, self.proj_vertex
+
+
+_projectors = threading.local()
+
+
+def get_projector(W=1024, H=64, fov_up=3.0, fov_down=-25.0, max_range=50.0):
+    """Return the projector for the given sensor model, built only once per
+    thread, since each projector owns its output buffers."""
+    if not hasattr(_projectors, "cache"):
+        _projectors.cache = {}
+    key = (W, H, fov_up, fov_down, max_range)
+    if key not in _projectors.cache:
+        _projectors.cache[key] = RangeImageProjector(*key)
+    return _projectors.cache[key]
+
+
+def project_to_range_image(
+    cloud, W=1024, H=64, max_range=50, fov_up=3.0, fov_down=-25.0
+):
+    """Project a pointcloud into a spherical projection image. Returns new
+    copies of the range image and the vertex map, see RangeImageProjector
+    to avoid the allocations."""
+    projector = get_projector(W, H, fov_up, fov_down, max_range)
+    proj_range, proj_vertex = projector.project(np.asarray(cloud.points))
+    return proj_range.copy(), proj_vertex.copy()
 
 
 @click.command()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import time
+
+import click
+import numpy as np
+import open3d as o3d
+import trimesh
+
+from .mesh_range_image import (
+    ray_triangle_intersection,
+    spherical_coords,
+    triangle_footprints,
+)
+
+
+class RayCaster:
+    """Common interface for all the ray-casting backends.
+
+    Backends are built once for a given mesh and answer first-hit queries
+    through intersects_location, which mimics the trimesh API and returns the
+    hit locations, the index of the rays that hit the mesh, and the index of
+    the hit triangles. Each backend keeps track of its own throughput.
+    """
+
+    name = None
+
+    def __init__(self, vertices, triangles):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+        self.triangles = np.ascontiguousarray(triangles, dtype=np.int64)
+        self.n_rays = 0
+        self.elapsed = 0.0
+
+    @property
+    def face_normals(self):
+        if not hasattr(self, "_face_normals"):
+            v = self.vertices[self.triangles]
+            normals = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+            norm = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._face_normals = normals / np.maximum(norm, 1e-12)
+        return self._face_normals
+
+    @property
+    def rays_per_second(self):
+        return self.n_rays / self.elapsed if self.elapsed > 0 else 0.0
+
+    def intersects_location(self, ray_origins, ray_directions):
+        start = time.perf_counter()
+        locations, index_ray, index_tri = self._intersect(
+            np.asarray(ray_origins, dtype=np.float64),
+            np.asarray(ray_directions, dtype=np.float64),
+        )
+        self.elapsed += time.perf_counter() - start
+        self.n_rays += len(ray_origins)
+        return locations, index_ray, index_tri
+
+    def _intersect(self, ray_origins, ray_directions):
+        raise NotImplementedError
+
+
+class EmbreeRayCaster(RayCaster):
+    """Intel Embree through trimesh and PyEmbree."""
+
+    name = "embree"
+
+    def __init__(self, vertices, triangles):
+        if not trimesh.ray.has_embree:
+            raise RuntimeError(
+                "PyEmbree engine not installed, this experiment will never end"
+            )
+        super().__init__(vertices, triangles)
+        self.tmesh = trimesh.Trimesh(vertices=vertices, faces=triangles)
+
+    @property
+    def face_normals(self):
+        return self.tmesh.face_normals
+
+    def _intersect(self, ray_origins, ray_directions):
+        return self.tmesh.ray.intersects_location(
+            ray_origins=ray_origins,
+            ray_directions=ray_directions,
+            multiple_hits=False,
+        )
+
+
+class Open3DRayCaster(RayCaster):
+    """Multi-threaded o3d.t.geometry.RaycastingScene, shipped with Open3D."""
+
+    name = "open3d"
+
+    def __init__(self, vertices, triangles):
+        super().__init__(vertices, triangles)
+        self.scene = o3d.t.geometry.RaycastingScene()
+        self.scene.add_triangles(
+            o3d.core.Tensor(self.vertices.astype(np.float32)),
+            o3d.core.Tensor(self.triangles.astype(np.uint32)),
+        )
+
+    def _intersect(self, ray_origins, ray_directions):
+        rays = np.hstack((ray_origins, ray_directions)).astype(np.float32)
+        ans = self.scene.cast_rays(o3d.core.Tensor(rays))
+        t_hit = ans["t_hit"].numpy()
+        index_ray = np.flatnonzero(np.isfinite(t_hit))
+        index_tri = ans["primitive_ids"].numpy()[index_ray].astype(np.int64)
+        locations = (
+            ray_origins[index_ray]
+            + t_hit[index_ray, None] * ray_directions[index_ray]
+        )
+        return locations, index_ray, index_tri
+
+
+class NumpyRayCaster(RayCaster):
+    """Pure NumPy fallback, no extra dependencies needed.
+
+    Rays sharing the same origin are binned in a spherical grid around it,
+    and only tested against the triangles overlapping their cell. The grid is
+    kept for the last origin, since all the rays of a scan start at the
+    sensor.
+    """
+
+    name = "numpy"
+
+    def __init__(self, vertices, triangles, W=1440, H=720):
+        super().__init__(vertices, triangles)
+        self.W = W
+        self.H = H
+        self._origin = None
+
+    def _build_grid(self, origin):
+        u, v, depth = spherical_coords(
+            self.vertices - origin, self.W, self.H, 90.0, -90.0
+        )
+        valid = depth[self.triangles].min(axis=1) > 0
+        tri, px, py = triangle_footprints(
+            u, v, self.triangles, self.W, self.H, valid, conservative=True
+        )
+        cells = py * self.W + px
+        order = np.argsort(cells, kind="stable")
+        self._cell_triangles = tri[order]
+        self._cell_start = np.searchsorted(
+            cells[order], np.arange(self.W * self.H + 1)
+        )
+        self._origin = origin.copy()
+
+    def _intersect_from(self, origin, ray_directions):
+        if self._origin is None or not np.array_equal(origin, self._origin):
+            self._build_grid(origin)
+        u, v, _ = spherical_coords(ray_directions, self.W, self.H, 90.0, -90.0)
+        px = np.floor(u).astype(np.int64) % self.W
+        py = np.clip(np.floor(v), 0, self.H - 1).astype(np.int64)
+        cells = py * self.W + px
+
+        # Enumerate all the (ray, triangle) candidate pairs
+        start = self._cell_start[cells]
+        counts = self._cell_start[cells + 1] - start
+        ray = np.repeat(np.arange(len(cells)), counts)
+        local = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        tri = self._cell_triangles[np.repeat(start, counts) + local]
+        hit, t = ray_triangle_intersection(
+            origin, ray_directions[ray], self.vertices, self.triangles[tri]
+        )
+        ray, tri, t = ray[hit], tri[hit], t[hit]
+
+        # Keep only the first hit of each ray
+        t_hit = np.full(len(cells), np.inf)
+        np.minimum.at(t_hit, ray, t)
+        first = t == t_hit[ray]
+        ray, index = np.unique(ray[first], return_index=True)
+        return ray, tri[first][index], t_hit[ray]
+
+    def _intersect(self, ray_origins, ray_directions):
+        origins, inverse = np.unique(ray_origins, axis=0, return_inverse=True)
+        index_ray, index_tri, t_hit = [], [], []
+        for i, origin in enumerate(origins):
+            rays = np.flatnonzero(inverse.ravel() == i)
+            ray, tri, t = self._intersect_from(origin, ray_directions[rays])
+            index_ray.append(rays[ray])
+            index_tri.append(tri)
+            t_hit.append(t)
+        index_ray = np.concatenate(index_ray)
+        index_tri = np.concatenate(index_tri)
+        t_hit = np.concatenate(t_hit)
+        locations = (
+            ray_origins[index_ray] + t_hit[:, None] * ray_directions[index_ray]
+        )
+        return locations, index_ray, index_tri
+
+
+RAYCASTERS = {
+    EmbreeRayCaster.name: EmbreeRayCaster,
+    Open3DRayCaster.name: Open3DRayCaster,
+    NumpyRayCaster.name: NumpyRayCaster,
+}
+
+
+def get_raycaster(name, vertices, triangles):
+    try:
+        return RAYCASTERS[name](vertices, triangles)
+    except KeyError:
+        raise ValueError(
+            "Unknown raycaster {}, choose one of {}".format(
+                name, list(RAYCASTERS)
+            )
+        )
+
+
+@click.command()
+@click.argument("mesh_file", type=click.Path(exists=True))
+@click.argument("scan_file", type=click.Path(exists=True))
+@click.option(
+    "--raycaster",
+    "-r",
+    type=click.Choice(["all"] + list(RAYCASTERS), case_sensitive=False),
+    default="all",
+    help="Which backend to benchmark",
+)
+@click.option("--n_runs", "-n", type=int, default=10)
+def main(mesh_file, scan_file, raycaster, n_runs):
+    """Benchmark the available ray-casting backends by shooting all the points
+    of the scan against the mesh, both expected in the sensor frame."""
+    mesh = o3d.io.read_triangle_mesh(mesh_file)
+    directions = np.asarray(o3d.io.read_point_cloud(scan_file).points)
+    origins = np.zeros_like(directions)
+    names = list(RAYCASTERS) if raycaster == "all" else [raycaster]
+    for name in names:
+        try:
+            start = time.perf_counter()
+            backend = get_raycaster(
+                name, np.asarray(mesh.vertices), np.asarray(mesh.triangles)
+            )
+            backend.intersects_location(origins, directions)
+            build_time = time.perf_counter() - start - backend.elapsed
+            for _ in range(n_runs - 1):
+                backend.intersects_location(origins, directions)
+        except RuntimeError as error:
+            print("{:>8s}: not available, {}".format(name, error))
+            continue
+        print(
+            "{:>8s}: {:.3e} rays/s, built in {:.3f} ms".format(
+                name, backend.rays_per_second, build_time * 1000.0
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
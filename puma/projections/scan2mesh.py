@@ -1,11 +1,7 @@
-import copy
-
 import numpy as np
 import open3d as o3d
-import trimesh
 
-if not trimesh.ray.has_embree:
-    raise "PyEmbree engine not installed, this experiment will never end"
+from .mesh_range_image import render_mesh_to_range_image, spherical_coords
 
 
 def outlier_rejection(
@@ -23,37 +19,56 @@ def outlier_rejection(
     return source_points, source_normals, target_points, target_normals
 
 
-def project_scan_to_mesh(tmesh, source, max_dist=2.0):
-    """Project a PointCloud to the given mesh using ray to triangle
-    intersections."""
+def associate_points_to_mesh(
+    intersector, source_points, source_normals, max_dist=2.0, sensor_pose=None
+):
+    """Same as project_scan_to_mesh, but on plain (N, 3) arrays. Returns the
+    paired source points and normals, and target points and normals."""
 
     # Create the rays we will shoot
-    source_points = np.asarray(source.points)
-    source_normals = np.asarray(source.normals)
-    ray_directions = copy.deepcopy(source_points)
-    ray_origins = np.zeros_like(ray_directions)
+    ray_origins = np.zeros_like(source_points)
+    if sensor_pose is not None:
+        ray_origins[:] = sensor_pose[:3, 3]
+    ray_directions = source_points - ray_origins
 
     # run the mesh- ray query
-    target_points, index_ray, index_tri = tmesh.ray.intersects_location(
-        ray_origins=ray_origins,
-        ray_directions=ray_directions,
-        multiple_hits=False,
+    target_points, index_ray, index_tri = intersector.intersects_location(
+        ray_origins, ray_directions
     )
 
     # Manually pick all the points and normals that did hit any of the triangles
     source_points = source_points[index_ray]
     source_normals = source_normals[index_ray]
-    target_normals = np.asarray(tmesh.face_normals[index_tri])
-
-    (
-        source_points,
-        source_normals,
-        target_points,
-        target_normals,
-    ) = outlier_rejection(
+    target_normals = np.asarray(intersector.face_normals[index_tri])
+
+    return outlier_rejection(
         source_points, source_normals, target_points, target_normals, max_dist
     )
 
+
+def project_scan_to_mesh(intersector, source, max_dist=2.0, sensor_pose=None):
+    """Project a PointCloud to the given mesh using ray to triangle
+    intersections. The intersector is any of the RayCaster backends built
+    for the mesh, see get_intersector.
+
+    Both the source and the mesh are expected in the same frame, and the rays
+    are casted from the origin of the sensor_pose(the origin of that frame if
+    not given) towards each point in the source.
+    """
+    return to_pointclouds(
+        *associate_points_to_mesh(
+            intersector,
+            np.asarray(source.points),
+            np.asarray(source.normals),
+            max_dist,
+            sensor_pose,
+        )
+    )
+
+
+def to_pointclouds(
+    source_points, source_normals, target_points, target_normals
+):
     # Create the new source and target PointClouds
     source_cloud = o3d.geometry.PointCloud()
     source_points = o3d.utility.Vector3dVector(np.asarray(source_points))
@@ -67,3 +82,87 @@ def project_scan_to_mesh(tmesh, source, max_dist=2.0):
     target_cloud.points = target_points
     target_cloud.normals = target_normals
     return source_cloud, target_cloud
+
+
+def associate_points_to_mesh_image(
+    vertices,
+    triangles,
+    source_points,
+    source_normals,
+    max_dist=2.0,
+    sensor_pose=None,
+    W=1024,
+    H=64,
+    fov_up=3.0,
+    fov_down=-25.0,
+    max_range=np.inf,
+):
+    """Same as project_scan_to_mesh_image, but on plain NumPy arrays."""
+    sensor_pose = np.eye(4) if sensor_pose is None else sensor_pose
+    _, vertex_map, normal_map = render_mesh_to_range_image(
+        vertices,
+        triangles,
+        sensor_pose,
+        W,
+        H,
+        fov_up=fov_up,
+        fov_down=fov_down,
+        max_range=max_range,
+    )
+
+    # Find the pixel of each point, as seen from the sensor_pose
+    local_points = (source_points - sensor_pose[:3, 3]) @ sensor_pose[:3, :3]
+    u, v, _ = spherical_coords(local_points, W, H, fov_up, fov_down)
+    proj_x = np.floor(u).astype(np.int64) % W
+    proj_y = np.floor(v)
+    in_fov = (proj_y >= 0) & (proj_y < H)
+    proj_y = np.clip(proj_y, 0, H - 1).astype(np.int64)
+
+    target_points = vertex_map[proj_y, proj_x]
+    target_normals = normal_map[proj_y, proj_x]
+    hits = in_fov & np.isfinite(target_points[:, 0])
+
+    return outlier_rejection(
+        source_points[hits],
+        source_normals[hits],
+        target_points[hits],
+        target_normals[hits],
+        max_dist,
+    )
+
+
+def project_scan_to_mesh_image(
+    mesh,
+    source,
+    max_dist=2.0,
+    sensor_pose=None,
+    W=1024,
+    H=64,
+    fov_up=3.0,
+    fov_down=-25.0,
+    max_range=np.inf,
+):
+    """Projective data association. The mesh is rendered into a (H, W)
+    range image as seen from the sensor_pose, and each point of the source is
+    paired with the surface hit by the pixel it falls in. The sensor model
+    should match the one used to preprocess the source.
+
+    Both the source and the mesh are expected in the same frame. Unlike
+    project_scan_to_mesh, no acceleration structure is needed, the cost of
+    the rendering only depends on the size of the mesh and the image.
+    """
+    return to_pointclouds(
+        *associate_points_to_mesh_image(
+            np.asarray(mesh.vertices),
+            np.asarray(mesh.triangles),
+            np.asarray(source.points),
+            np.asarray(source.normals),
+            max_dist,
+            sensor_pose,
+            W,
+            H,
+            fov_up,
+            fov_down,
+            max_range,
+        )
+    )
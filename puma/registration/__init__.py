@@ -1,5 +1,7 @@
+from .align import *
 from .method_selector import *
 from .o3d_aliases import *
 from .run_icp import *
+from .sampled_target import *
 from .scan2mesh import *
 from .scan2mesh_icp import *
@@ -0,0 +1,90 @@
+import numpy as np
+import open3d as o3d
+
+from ..projections import to_pointclouds
+from .method_selector import get_te_method, huber_weights
+
+
+def align_clouds(source, target, method):
+    """Align 2 PointCloud objects assuming 1-1 correspondences."""
+    assert len(source.points) == len(target.points), "N of points must match!"
+    corr = np.zeros((len(source.points), 2))
+    corr[:, 0] = np.arange(len(source.points))
+    corr[:, 1] = np.arange(len(target.points))
+    te = get_te_method(method)
+    return te.compute_transformation(
+        source, target, o3d.utility.Vector2iVector(corr)
+    )
+
+
+def skew(v):
+    return np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+
+
+def exp_se3(x):
+    """Convert a (rx, ry, rz, tx, ty, tz) twist into a 4x4 transformation."""
+    T = np.eye(4)
+    theta = np.linalg.norm(x[:3])
+    if theta < 1e-12:
+        T[:3, :3] += skew(x[:3])
+    else:
+        K = skew(x[:3] / theta)
+        T[:3, :3] += np.sin(theta) * K + (1.0 - np.cos(theta)) * K @ K
+    T[:3, 3] = x[3:]
+    return T
+
+
+def align_point_to_plane(source_points, target_points, target_normals):
+    """One Gauss-Newton step of the point-to-plane error, robustified with
+    the same Huber kernel used by get_te_method("p2l"). Degenerate inputs,
+    as a flat patch, return the identity like Open3D does: the step is
+    rejected when the determinant of the normal equations is too small."""
+    residuals = np.einsum(
+        "ij,ij->i", source_points - target_points, target_normals
+    )
+    J = np.hstack((np.cross(source_points, target_normals), target_normals))
+    w = huber_weights(residuals)
+    JTJ = J.T @ (J * w[:, None])
+    JTr = J.T @ (w * residuals)
+    # Same check as Open3D's SolveLinearSystemPSD
+    det = np.linalg.det(JTJ)
+    if not np.isfinite(det) or abs(det) < 1e-6:
+        return np.eye(4)
+    return exp_se3(np.linalg.solve(JTJ, -JTr))
+
+
+def align_point_to_point(source_points, target_points):
+    """Closed form point-to-point alignment(Kabsch), without scaling."""
+    source_mean = source_points.mean(axis=0)
+    target_mean = target_points.mean(axis=0)
+    H = (source_points - source_mean).T @ (target_points - target_mean)
+    U, _, Vt = np.linalg.svd(H)
+    S = np.eye(3)
+    S[2, 2] = np.sign(np.linalg.det(Vt.T @ U.T))
+    T = np.eye(4)
+    T[:3, :3] = Vt.T @ S @ U.T
+    T[:3, 3] = target_mean - T[:3, :3] @ source_mean
+    return T
+
+
+def align_points(
+    source_points, source_normals, target_points, target_normals, method
+):
+    """Align 2 sets of points assuming 1-1 correspondences, staying on plain
+    NumPy arrays. GICP is not implemented here and falls back to Open3D."""
+    if method == "p2l":
+        return align_point_to_plane(
+            source_points, target_points, target_normals
+        )
+    if method == "p2p":
+        return align_point_to_point(source_points, target_points)
+    source, target = to_pointclouds(
+        source_points, source_normals, target_points, target_normals
+    )
+    return align_clouds(source, target, method)
+
+
+def transform_points(points, normals, T):
+    """Apply the 4x4 transformation T to the given points and normals."""
+    R = T[:3, :3]
+    return points @ R.T + T[:3, 3], normals @ R.T
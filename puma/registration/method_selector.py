@@ -1,7 +1,11 @@
+import numpy as np
 import open3d as o3d
 
 from .o3d_aliases import GICP, PointToPlane, PointToPoint
 
+# Scale of the Huber robust kernel used for point-to-plane registration
+HUBER_K = 0.5
+
 
 def get_te_method(str_method):
     if str_method == "gicp":
@@ -9,6 +13,11 @@ def get_te_method(str_method):
     if str_method == "p2p":
         return PointToPoint()
     if str_method == "p2l":
-        loss = o3d.pipelines.registration.HuberLoss(0.5)
+        loss = o3d.pipelines.registration.HuberLoss(HUBER_K)
         return PointToPlane(loss)
     return None
+
+
+def huber_weights(residuals, k=HUBER_K):
+    """IRLS weights of the Huber loss, same as Open3D's HuberLoss."""
+    return k / np.maximum(np.abs(residuals), k)
@@ -0,0 +1,104 @@
+import numpy as np
+import open3d as o3d
+
+from ..utils import MeshCache
+from .align import align_points
+from .run_icp import run_icp
+
+_targets = MeshCache()
+
+
+class SampledTarget:
+    """The vertices of a mesh used as the target of the "sample" strategy,
+    together with everything ICP needs from the target side: normals, GICP
+    covariances and the nearest neighbor search index. GICP runs through
+    Open3D, which builds its own index, so only the covariances are computed
+    in that case."""
+
+    def __init__(self, mesh, method="p2l"):
+        self.points = np.asarray(mesh.vertices).copy()
+        self.normals = np.asarray(mesh.vertex_normals).copy()
+        self.cloud = o3d.geometry.PointCloud()
+        self.cloud.points = o3d.utility.Vector3dVector(self.points)
+        self.cloud.normals = o3d.utility.Vector3dVector(self.normals)
+        self.nns = None
+        if method == "gicp":
+            self.cloud.estimate_covariances()
+        else:
+            self.nns = o3d.core.nns.NearestNeighborSearch(
+                o3d.core.Tensor(self.points)
+            )
+            self.nns.knn_index()
+
+    def search(self, points):
+        """Return the index of the closest target point and the squared
+        distance to it for each of the given points."""
+        indices, distances = self.nns.knn_search(o3d.core.Tensor(points), 1)
+        return indices.numpy()[:, 0].astype(np.int64), distances.numpy()[:, 0]
+
+
+def get_sampled_target(mesh, version=None, method="p2l", max_size=2):
+    """Same caching policy as get_intersector, but for the "sample" strategy,
+    the target is built only once for each (mesh, version, method) tuple."""
+    if version is None:
+        return SampledTarget(mesh, method)
+
+    return _targets.get(
+        mesh,
+        (version, method),
+        lambda: SampledTarget(mesh, method),
+        max_size,
+    )
+
+
+def run_icp_to_target(
+    src,
+    target,
+    trans_init,
+    config,
+    max_iteration=30,
+    relative_fitness=1e-6,
+    relative_rmse=1e-6,
+):
+    """Same as run_icp, with the same convergence criteria, but reusing the
+    search index of the given SampledTarget instead of building a new one
+    on each call. Only the source side is processed per call."""
+    if config.method == "gicp":
+        # Open3D reuses the precomputed covariances of the target
+        return run_icp(src, target.cloud, trans_init, config)
+
+    points = np.asarray(src.points)
+    normals = np.asarray(src.normals)
+    if not src.has_normals():
+        normals = np.zeros_like(points)
+
+    transformation = trans_init.copy()
+    prev_fitness, prev_rmse = 0.0, 0.0
+    for i in range(max_iteration):
+        source_points = points @ transformation[:3, :3].T
+        source_points += transformation[:3, 3]
+        indices, distances = target.search(source_points)
+        inliers = distances < config.threshold**2
+        if not inliers.any():
+            break
+
+        fitness = inliers.mean()
+        rmse = np.sqrt(distances[inliers].mean())
+        if (
+            i > 0
+            and abs(fitness - prev_fitness) < relative_fitness
+            and abs(rmse - prev_rmse) < relative_rmse
+        ):
+            break
+        prev_fitness, prev_rmse = fitness, rmse
+
+        T = align_points(
+            source_points[inliers],
+            normals[inliers],
+            target.points[indices[inliers]],
+            target.normals[indices[inliers]],
+            config.method,
+        )
+        transformation = T @ transformation
+
+    return transformation
@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-import open3d as o3d
 
 from .run_icp import run_icp
+from .sampled_target import get_sampled_target, run_icp_to_target
 from .scan2mesh_icp import scan2mesh_icp
 
+# Runs the frame-to-frame fallback registration in speculative mode
+_fallback_executor = ThreadPoolExecutor(max_workers=1)
+
 
 def lost_track(delta, max_t_err=0.4):
     """Return True if the estimation from the mesh is to big."""
@@ -12,20 +17,62 @@ def lost_track(delta, max_t_err=0.4):
 
 
 def register_scan_to_mesh(
-    source, mesh, initial_guess, deltas, last_scan, config
+    source,
+    mesh,
+    initial_guess,
+    deltas,
+    last_scan,
+    config,
+    mesh_version=None,
+    sensor_pose=None,
 ):
+    """Register the source scan against the mesh. If a sensor_pose is given,
+    the mesh is expected in the world frame, otherwise in the sensor frame."""
     te = config.method
     th = config.threshold
     if config.strategy == "sample":
-        tgt = o3d.geometry.PointCloud()
-        tgt.points = o3d.utility.Vector3dVector(mesh.vertices)
-        tgt.normals = o3d.utility.Vector3dVector(mesh.vertex_normals)
-        pose = run_icp(source, tgt, initial_guess, config)
+        # The target and its search index only change with the mesh
+        tgt = get_sampled_target(mesh, mesh_version, config.method)
+        if sensor_pose is None:
+            pose = run_icp_to_target(source, tgt, initial_guess, config)
+        else:
+            # Register in the world frame, moving the scan and not the mesh
+            pose = run_icp_to_target(
+                source, tgt, sensor_pose @ initial_guess, config
+            )
+            pose = np.linalg.inv(sensor_pose) @ pose
     else:
-        success, pose = scan2mesh_icp(mesh, source, initial_guess, th, te)
-        if not success:
-            return run_icp(source, last_scan, initial_guess, config)
-
-        if lost_track(np.linalg.inv(deltas[-1]) @ pose):
-            pose = run_icp(source, last_scan, initial_guess, config)
+        # In speculative mode the frame-to-frame fallback runs at the same
+        # time, Open3D and the ray-casting backends release the GIL
+        fallback = None
+        if config.get("speculative", False):
+            fallback = _fallback_executor.submit(
+                run_icp, source, last_scan, initial_guess, config
+            )
+        success, pose, _ = scan2mesh_icp(
+            mesh,
+            source,
+            initial_guess,
+            th,
+            te,
+            mesh_version=mesh_version,
+            sensor_pose=sensor_pose,
+            association=config.get("association", "raycasting"),
+            W=config.W,
+            H=config.H,
+            fov_up=config.get("fov_up", 3.0),
+            fov_down=config.get("fov_down", -25.0),
+            max_range=config.get("max_range", 50.0),
+            raycaster=config.get("raycaster", "embree"),
+            schedule=config.get("schedule", [1]),
+            crop_bucket=config.get("crop_bucket", None),
+        )
+        # Always wait for the fallback, the caller might modify the scans
+        fallback_pose = fallback.result() if fallback else None
+        if not success or lost_track(np.linalg.inv(deltas[-1]) @ pose):
+            if fallback_pose is None:
+                fallback_pose = run_icp(
+                    source, last_scan, initial_guess, config
+                )
+            pose = fallback_pose
     return pose
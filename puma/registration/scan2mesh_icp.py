@@ -1,23 +1,20 @@
-import copy
-
 import numpy as np
-import open3d as o3d
-import trimesh
 
-from ..projections import project_scan_to_mesh
-from .method_selector import get_te_method
+from ..projections import (
+    associate_points_to_mesh,
+    associate_points_to_mesh_image,
+    get_intersector,
+)
+from .align import align_points, transform_points
 
 
-def align_clouds(source, target, method):
-    """Align 2 PointCloud objects assuming 1-1 correspondences."""
-    assert len(source.points) == len(target.points), "N of points must match!"
-    corr = np.zeros((len(source.points), 2))
-    corr[:, 0] = np.arange(len(source.points))
-    corr[:, 1] = np.arange(len(target.points))
-    te = get_te_method(method)
-    return te.compute_transformation(
-        source, target, o3d.utility.Vector2iVector(corr)
-    )
+def compute_residuals(source_points, target_points, target_normals, method):
+    """Residuals of the 1-1 correspondences between 2 sets of points,
+    point-to-plane for "p2l" and point-to-point otherwise."""
+    diff = source_points - target_points
+    if method == "p2l":
+        return np.abs(np.einsum("ij,ij->i", diff, target_normals))
+    return np.linalg.norm(diff, axis=1)
 
 
 def scan2mesh_icp(
@@ -29,48 +26,158 @@ def scan2mesh_icp(
     max_iterations=30,
     tolerance=0.00001,
     debug=False,
+    mesh_version=None,
+    sensor_pose=None,
+    association="raycasting",
+    W=1024,
+    H=64,
+    fov_up=3.0,
+    fov_down=-25.0,
+    max_range=np.inf,
+    raycaster="embree",
+    schedule=None,
+    min_points=1000,
+    crop_bucket=None,
 ):
-    source = copy.deepcopy(pcd)
-    prev_error = 0
-    distances = 0
-    transformation = trans_init
-    source.transform(trans_init)
-
-    # Convert from Open3D mesh object to a trimesh one
-    tmesh = trimesh.Trimesh(
-        vertices=np.asarray(mesh.vertices), faces=np.asarray(mesh.triangles)
-    )
-    for i in range(max_iterations):
-        # Project the input cloud to the mesh and obtain the projected cloud
-        source, target = project_scan_to_mesh(tmesh, source, max_dist)
-        if (
-            not target.has_points()
-            or not target.has_normals()
-            or len(target.points) < 1000
-        ):
-            return False, None
-
-        # compute the transformation between clouds
-        T = align_clouds(source, target, method)
-
-        # update the current source
-        source.transform(T)
-        transformation = T @ transformation
-
-        # check error
-        distances = source.compute_point_cloud_distance(target)
-        mean_error = np.mean(distances)
-        if np.abs(prev_error - mean_error) < tolerance:
-            break
-
-        if debug:
-            print("Iteration {} completed".format(i))
-            print("Number of inliers :", len(source.points))
-            print(
-                "mean_error = {err}, prev_error = {prev}".format(
-                    err=mean_error, prev=prev_error
+    """Register the given PointCloud against the mesh using ray-casting. The
+    whole registration runs on NumPy arrays, see align_points.
+
+    If a sensor_pose is given the mesh is expected to be in the world frame
+    and the rays are casted from the origin of the sensor_pose, otherwise the
+    mesh is expected to be already in the sensor frame. In both cases, the
+    estimated transformation is expressed in the sensor frame.
+
+    The association can be either "raycasting", one ray per point against the
+    BVH built by the given raycaster backend, or "projective", where the mesh
+    is rendered into a (H, W) range image at the current estimate, with the
+    fov_up, fov_down and max_range sensor model, and the points are paired
+    per pixel.
+
+    The schedule is a list of strides, e.g. [4, 2, 1]. Early levels only cast
+    every stride-th point and get an even share of the max_iterations, the
+    last level runs for the remaining ones. The registration fails if fewer
+    than min_points / stride points could be associated.
+
+    If a crop_bucket size is given, the intersector is only built over the
+    part of the mesh that the rays of this scan can reach, see get_intersector.
+
+    Returns whether the registration succeeded, the estimated transformation
+    and the mean residual of each iteration.
+    """
+    sensor_pose = np.eye(4) if sensor_pose is None else sensor_pose
+    schedule = schedule or [1]
+    transformation = sensor_pose @ trans_init
+
+    # Stay on contiguous arrays for the whole registration
+    points = np.asarray(pcd.points)
+    normals = np.asarray(pcd.normals)
+    if not pcd.has_normals():
+        normals = np.zeros_like(points)
+
+    # Build the ray-casting backend, reusing the BVH built for this version of
+    # the mesh if any
+    if association == "projective":
+        vertices = np.asarray(mesh.vertices)
+        triangles = np.asarray(mesh.triangles)
+    elif crop_bucket:
+        # Longest ray we might cast, the sensor might move up to the initial
+        # guess and the associations are pruned at max_dist
+        reach = np.linalg.norm(points, axis=1).max(initial=0.0)
+        reach += np.linalg.norm(trans_init[:3, 3]) + max_dist
+        intersector = get_intersector(
+            mesh,
+            mesh_version,
+            raycaster,
+            center=sensor_pose[:3, 3],
+            radius=reach,
+            bucket_size=crop_bucket,
+        )
+    else:
+        intersector = get_intersector(mesh, mesh_version, raycaster)
+
+    # Coarse-to-fine, each level only casts every stride-th point of the scan
+    n_iterations = 0
+    errors = []
+    for level, stride in enumerate(schedule):
+        if level == len(schedule) - 1:
+            level_iterations = max_iterations - n_iterations
+        else:
+            level_iterations = max_iterations // len(schedule)
+        source_points, source_normals = transform_points(
+            points[::stride], normals[::stride], transformation
+        )
+        prev_error = 0
+        for i in range(level_iterations):
+            n_iterations += 1
+            # Project the input cloud to the mesh and obtain the projected cloud
+            if association == "projective":
+                (
+                    source_points,
+                    source_normals,
+                    target_points,
+                    target_normals,
+                ) = associate_points_to_mesh_image(
+                    vertices,
+                    triangles,
+                    source_points,
+                    source_normals,
+                    max_dist,
+                    transformation,
+                    W,
+                    H,
+                    fov_up,
+                    fov_down,
+                    max_range,
                 )
+            else:
+                (
+                    source_points,
+                    source_normals,
+                    target_points,
+                    target_normals,
+                ) = associate_points_to_mesh(
+                    intersector,
+                    source_points,
+                    source_normals,
+                    max_dist,
+                    sensor_pose,
+                )
+            if len(target_points) < min_points // stride:
+                return False, None, errors
+
+            # compute the transformation between the paired points
+            T = align_points(
+                source_points,
+                source_normals,
+                target_points,
+                target_normals,
+                method,
             )
-        prev_error = mean_error
 
-    return True, transformation
+            # update the current source
+            source_points, source_normals = transform_points(
+                source_points, source_normals, T
+            )
+            transformation = T @ transformation
+
+            # check error, source and target are already paired
+            mean_error = np.mean(
+                compute_residuals(
+                    source_points, target_points, target_normals, method
+                )
+            )
+            errors.append(mean_error)
+            if np.abs(prev_error - mean_error) < tolerance:
+                break
+
+            if debug:
+                print("Iteration {} completed, stride {}".format(i, stride))
+                print("Number of inliers :", len(source_points))
+                print(
+                    "mean_error = {err}, prev_error = {prev}".format(
+                        err=mean_error, prev=prev_error
+                    )
+                )
+            prev_error = mean_error
+
+    return True, np.linalg.inv(sensor_pose) @ transformation, errors
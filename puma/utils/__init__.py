@@ -1,7 +1,11 @@
 from .calibration import *
 from .circular_buffer import *
 from .config import *
+from .convert import *
 from .kitti_poses import *
+from .mesh_cache import *
+from .pointcloud2 import *
+from .prefetch import *
 from .progress_bar import *
 from .save_geoms import *
 from .timeit import *
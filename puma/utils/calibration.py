@@ -1,7 +1,6 @@
 import numpy as np
 import pykitti
 
-
 T_cam_velo = np.array(
     [
         [4.27680239e-04, -9.99967248e-01, -8.08449168e-03, -1.19845993e-02],
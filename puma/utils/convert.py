@@ -0,0 +1,62 @@
+import os
+import time
+
+from tqdm import tqdm
+
+from .prefetch import prefetch
+
+
+def temp_filename(filename):
+    """Hidden file next to filename, with the same extension so writers that
+    pick the format from it(e.g., Open3D) still work."""
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, ".tmp_" + basename)
+
+
+def _convert(job):
+    convert_fn, args, out_file = job
+    tmp_file = temp_filename(out_file)
+    convert_fn(*args, tmp_file)
+    # Atomic, out_file either does not exist or it's complete
+    os.replace(tmp_file, out_file)
+
+
+def convert_files(convert_fn, jobs, total=None, n_workers=None):
+    """Run convert_fn(*args, out_file) for each (args, out_file) job on a pool
+    of n_workers processes(one per CPU by default).
+
+    Each output is written to a temporary file and then renamed, so an
+    interrupted conversion can be resumed by running it again: the jobs whose
+    output already exists are skipped. Returns the number of converted files.
+    """
+    n_workers = n_workers or os.cpu_count()
+    pbar = tqdm(total=total, unit=" scans", dynamic_ncols=True)
+    n_skipped = 0
+
+    def pending():
+        nonlocal n_skipped
+        for args, out_file in jobs:
+            if os.path.exists(out_file):
+                n_skipped += 1
+                pbar.update()
+                continue
+            yield convert_fn, args, out_file
+
+    start = time.perf_counter()
+    n_converted = 0
+    for _ in prefetch(
+        _convert, pending(), n_workers, 4 * n_workers, processes=True
+    ):
+        n_converted += 1
+        pbar.update()
+    pbar.close()
+    elapsed = time.perf_counter() - start
+    print(
+        "Converted {} scans in {:.1f} s ({:.1f} scans/s), skipped {}".format(
+            n_converted,
+            elapsed,
+            n_converted / elapsed if elapsed > 0 else 0.0,
+            n_skipped,
+        )
+    )
+    return n_converted
@@ -0,0 +1,33 @@
+import threading
+from collections import OrderedDict
+
+
+class MeshCache:
+    """Thread-safe LRU cache of objects built from a mesh, e.g. its ray-casting
+    BVH, keyed by the mesh itself plus a caller defined key that should
+    include the version of the mesh."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, mesh, key, build, max_size):
+        """Return the cached object for (mesh, key), calling build() to create
+        it on a miss. Only the max_size most recently used are kept."""
+        # Keeping a reference to the mesh guarantees that id(mesh) is not reused
+        key = (id(mesh),) + tuple(key)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+
+        value = build()
+        with self.lock:
+            self.entries[key] = (mesh, value)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,88 @@
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+# sensor_msgs/PointField datatypes, no ROS installation needed
+POINTFIELD_DTYPES = {
+    1: np.dtype(np.int8),
+    2: np.dtype(np.uint8),
+    3: np.dtype(np.int16),
+    4: np.dtype(np.uint16),
+    5: np.dtype(np.int32),
+    6: np.dtype(np.uint32),
+    7: np.dtype(np.float32),
+    8: np.dtype(np.float64),
+}
+POINTFIELD_DATATYPES = {v: k for k, v in POINTFIELD_DTYPES.items()}
+
+
+def pointcloud2_dtype(fields, point_step, is_bigendian=False):
+    """Structured dtype of one point, mapping each PointField at its offset.
+    Any padding between the fields is kept out of the dtype."""
+    byteorder = ">" if is_bigendian else "<"
+    formats = []
+    for field in fields:
+        dtype = POINTFIELD_DTYPES[field.datatype].newbyteorder(byteorder)
+        formats.append((dtype, field.count) if field.count > 1 else dtype)
+    return np.dtype(
+        {
+            "names": [field.name for field in fields],
+            "formats": formats,
+            "offsets": [field.offset for field in fields],
+            "itemsize": point_step,
+        }
+    )
+
+
+def pointcloud2_to_array(msg):
+    """Zero-copy structured view of the buffer of a PointCloud2 message, with
+    shape (height, width). Only the duck-typed attributes of the message are
+    used, so it also works with synthetic messages."""
+    dtype = pointcloud2_dtype(msg.fields, msg.point_step, msg.is_bigendian)
+    return np.ndarray(
+        shape=(msg.height, msg.width),
+        dtype=dtype,
+        buffer=memoryview(msg.data),
+        strides=(msg.row_step, msg.point_step),
+    )
+
+
+def read_points_array(msg, field_names, skip_nans=True, dtype=np.float64):
+    """Vectorized replacement of sensor_msgs.point_cloud2.read_points_list.
+    Returns a (N, len(field_names)) array, with all the scalar field_names of
+    each point, dropping the points with any NaN value if skip_nans."""
+    points = pointcloud2_to_array(msg)[field_names].reshape(-1)
+    points = structured_to_unstructured(points, dtype=dtype)
+    if skip_nans:
+        points = points[~np.isnan(points).any(axis=1)]
+    return points
+
+
+def array_to_pointcloud2(points):
+    """Encode a structured array of points, one field per channel, into the
+    (fields, point_step, data) triplet of a PointCloud2 message. Each field is
+    a (name, offset, datatype, count) tuple, as taken by PointField. The data
+    is always little endian, as expected by is_bigendian=False."""
+    points = np.ascontiguousarray(points.reshape(-1))
+    fields = []
+    for name in points.dtype.names:
+        dtype, offset = points.dtype.fields[name][:2]
+        count = int(np.prod(dtype.shape)) if dtype.shape else 1
+        datatype = POINTFIELD_DATATYPES[dtype.base.newbyteorder("=")]
+        fields.append((name, offset, datatype, count))
+    little_endian = points.dtype.newbyteorder("<")
+    return fields, points.dtype.itemsize, points.astype(little_endian).tobytes()
+
+
+def xyzi_to_structured(points):
+    """Zero-copy view of a (N, 4) float32 array, as loaded from a KITTI .bin
+    file, as a structured array with x, y, z and intensity fields."""
+    dtype = np.dtype(
+        [
+            ("x", np.float32),
+            ("y", np.float32),
+            ("z", np.float32),
+            ("intensity", np.float32),
+        ]
+    )
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    return points.view(dtype).reshape(-1)
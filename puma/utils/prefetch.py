@@ -0,0 +1,21 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def prefetch(fn, items, n_workers=2, n_ahead=4, processes=False):
+    """Lazily yield fn(item) for each item, in order, while the next n_ahead
+    items are already being processed by a pool of n_workers threads, or
+    processes if fn holds the GIL(fn and the items must be picklable then).
+
+    At most n_ahead results are kept waiting for the consumer, so a slow
+    consumer(e.g., registration + PSR) puts backpressure on the pool.
+    """
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=n_workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) > n_ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()